@@ -2,12 +2,17 @@
 """
 视频处理工作流程编排器 - FastAPI 服务 (优化版)
 """
+import queue
+import atexit
+import asyncio
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from datetime import datetime
 import os  # 新增导入，用于环境变量访问和路径操作
 
 # 第三方库
+import orjson
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
@@ -18,6 +23,8 @@ from dotenv import load_dotenv
 # 本地模块
 from settings import get_settings
 from routers import upload, process, export, download, agent
+from services.task_manager import get_task_manager
+from utils.image_hash import shutdown_hash_pool
 
 # 自定义静态文件类，添加缓存头
 class CustomStaticFiles(StaticFiles):
@@ -30,15 +37,21 @@ class CustomStaticFiles(StaticFiles):
 load_dotenv()
 settings = get_settings()
 
-# 配置日志
+# 配置日志：各线程只把记录放入队列，由单独的监听线程负责写文件和控制台，
+# 避免处理任务的线程在文件写锁上互相等待
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(
+    log_queue,
+    logging.FileHandler('video_processing.log'),
+    logging.StreamHandler()
+)
 logging.basicConfig(
-    level=logging.INFO,
+    level=settings.LOG_LEVEL.upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('video_processing.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # 创建 FastAPI 应用
@@ -48,13 +61,31 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# 任务进度元数据的后台批量落盘
+@app.on_event("startup")
+async def start_metadata_flusher():
+    app.state.metadata_flusher = asyncio.create_task(get_task_manager().run_flush_loop())
+
+@app.on_event("shutdown")
+async def stop_metadata_flusher():
+    app.state.metadata_flusher.cancel()
+    try:
+        await app.state.metadata_flusher
+    except asyncio.CancelledError:
+        pass
+
+@app.on_event("shutdown")
+async def stop_hash_pool():
+    await asyncio.to_thread(shutdown_hash_pool)
+
 # 启用 GZip 压缩（必须在 CORS 之前添加）
 app.add_middleware(GZipMiddleware, minimum_size=500)
 
 # 配置 CORS (生产环境建议指定具体源)
 # 根据环境变量或设置动态配置允许的源，优先使用配置的 FRONTEND_URL，否则在本地模式下允许所有源
 if settings.DEPLOYMENT_MODE == "local":
-    allow_origins = ["*"]  # 本地开发允许所有源
+    # 本地开发：配置了 FRONTEND_URL 时只放行该源，否则允许所有源
+    allow_origins = [settings.FRONTEND_URL] if settings.FRONTEND_URL else ["*"]
 else:
     # 生产环境：如果配置了 FRONTEND_URL，则使用它；否则默认为空列表（更安全）
     allow_origins = [settings.FRONTEND_URL] if settings.FRONTEND_URL else []
@@ -64,7 +95,8 @@ else:
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allow_origins,
-    allow_credentials=True,  # 如果前端需要携带认证信息（如cookies），请设置为True
+    # 通配源与携带凭证不符合 CORS 规范，且会让中间件按请求动态回写 Origin；仅显式源列表时开启
+    allow_credentials="*" not in allow_origins,
     allow_methods=["*"],
     allow_headers=["*"],
 )
@@ -94,10 +126,12 @@ app.include_router(export.router)
 app.include_router(download.router)
 app.include_router(agent.router)
 
-# 基础配置查询（供前端读取运行时配置）
+# 基础配置查询（供前端读取运行时配置）；配置在进程内不变，响应体启动时编码一次
+_CONFIG_BYTES = orjson.dumps({"mode": settings.DEPLOYMENT_MODE, "api_base_url": settings.public_api_base_url})
+
 @app.get("/api/config")
 async def api_config():
-    return {"mode": settings.DEPLOYMENT_MODE, "api_base_url": settings.public_api_base_url}
+    return Response(content=_CONFIG_BYTES, media_type="application/json")
 
 # 挂载静态文件目录，添加缓存头
 app.mount("/storage", CustomStaticFiles(directory="storage"), name="storage")
@@ -131,13 +165,21 @@ if __name__ == "__main__":
     logger.info("🔍 健康检查: http://localhost:8000/api/health")
     logger.info("📤 上传接口: http://localhost:8000/api/upload")
 
-    # 根据部署模式决定是否启用重载
-    reload_enabled = settings.DEPLOYMENT_MODE == "local"
+    # 热重载仅用于开发：会启动文件监听子进程，且无法与多 worker 同时使用
+    reload_enabled = settings.RELOAD if settings.RELOAD is not None else settings.DEPLOYMENT_MODE == "local"
+    workers = max(1, settings.UVICORN_WORKERS)
+    if reload_enabled and workers > 1:
+        logger.warning("热重载模式下忽略 UVICORN_WORKERS，使用单 worker")
+        workers = 1
 
+    # loop/http 使用 auto：安装了 uvicorn[standard] 时自动选用 uvloop 与 httptools
     uvicorn.run(
         "main:app",
         host=settings.SERVER_HOST,
         port=settings.SERVER_PORT,
-        reload=reload_enabled,  # 仅在本地开发模式启用热重载
+        reload=reload_enabled,
+        workers=workers,
+        loop="auto",
+        http="auto",
         log_level="info"
     )
@@ -1,5 +1,5 @@
 """API数据模型"""
-from typing import Optional
+from typing import List, Literal, Optional
 from pydantic import BaseModel
 
 
@@ -14,3 +14,10 @@ class TaskStatus(BaseModel):
 class ProcessRequest(BaseModel):
     enable_multimodal: bool = True
     keep_temp: bool = False
+    # 起始阶段：非 extract_audio 时复用任务目录中已有的前序结果（可用于已完成/失败任务的重跑）
+    start_from: Literal["extract_audio", "asr", "merge_text", "summary", "multimodal"] = "extract_audio"
+
+
+class BatchProcessRequest(ProcessRequest):
+    # 使用相同参数批量开始处理的任务ID列表
+    task_ids: List[str]
@@ -1,30 +1,30 @@
 """在线视频下载相关路由"""
 import shutil
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException
 
 from models.download_models import DownloadUrlRequest, DownloadStatus, Platform
-from services.task_manager import TaskManager
+from services.task_manager import get_task_manager
 from services.platform_detector import PlatformDetector
 from services.video_downloader import VideoDownloaderService
-from services.video_processor import VideoProcessingWorkflow
+from services.video_processor import get_workflow, submit_job
+from services.ffmpeg_process import SNIFF_BYTES, looks_like_video
 from utils.task_logger import TaskLogger
 
 router = APIRouter(prefix="/api", tags=["download"])
 
 # 全局服务实例
-task_manager = TaskManager()
+task_manager = get_task_manager()
 platform_detector = PlatformDetector()
 downloader_service = VideoDownloaderService()
 
 
 @router.post("/download-url")
-async def download_from_url(request: DownloadUrlRequest, background_tasks: BackgroundTasks):
+async def download_from_url(request: DownloadUrlRequest):
     """
     从在线视频URL下载并处理视频
     
     Args:
         request: 包含视频URL和下载参数的请求
-        background_tasks: FastAPI后台任务
         
     Returns:
         任务ID和基本信息
@@ -57,18 +57,11 @@ async def download_from_url(request: DownloadUrlRequest, background_tasks: Backg
     # 4. 创建任务
     task_id = task_manager.create_task(f"{platform}_{video_title}")
     
-    # 5. 启动后台下载和处理
-    background_tasks.add_task(
-        download_and_process_video,
-        task_id,
-        request.url,
-        platform,
-        request.quality,
-        video_info
-    )
-    
-    # 6. 更新初始状态
+    # 5. 更新初始状态
     task_manager.update_status(task_id, "downloading")
+
+    # 6. 在专用线程池中启动下载和处理
+    submit_job(download_and_process_video, task_id, request.url, platform, request.quality, video_info)
     
     return {
         "task_id": task_id,
@@ -83,7 +76,7 @@ async def download_from_url(request: DownloadUrlRequest, background_tasks: Backg
 async def get_download_status(task_id: str):
     """获取下载任务状态"""
     try:
-        metadata = task_manager.load_metadata(task_id)
+        metadata = await task_manager.aload_metadata(task_id)
         return DownloadStatus(
             task_id=task_id,
             status=metadata["status"],
@@ -91,7 +84,7 @@ async def get_download_status(task_id: str):
             title=metadata.get("title"),
             error_message=metadata.get("error_message")
         )
-    except:
+    except Exception:
         raise HTTPException(status_code=404, detail="任务不存在")
 
 
@@ -164,22 +157,21 @@ async def preview_video_info(request: DownloadUrlRequest):
         raise HTTPException(status_code=400, detail=f"获取视频信息失败: {str(e)}")
 
 
-async def download_and_process_video(task_id: str, url: str, platform: Platform, 
-                                   quality, video_info: dict):
-    """后台下载和处理视频"""
+def download_and_process_video(task_id: str, url: str, platform: Platform,
+                               quality, video_info: dict):
+    """后台下载和处理视频（在专用线程池中执行）"""
     task_logger = None
     try:
         task_dir = task_manager.get_task_dir(task_id)
         task_logger = TaskLogger.get_logger(task_id, str(task_dir))
         
         # 更新任务元数据
-        metadata = task_manager.load_metadata(task_id)
-        metadata.update({
-            "platform": platform.value,
-            "title": video_info.get("title", "Unknown"),
-            "url": url
-        })
-        task_manager.save_metadata(task_id, metadata)
+        task_manager.update_metadata(
+            task_id,
+            platform=platform.value,
+            title=video_info.get("title", "Unknown"),
+            url=url
+        )
         
         # 1. 下载视频
         task_logger.info(f"开始下载 {platform} 视频: {url}")
@@ -192,18 +184,26 @@ async def download_and_process_video(task_id: str, url: str, platform: Platform,
         # 2. 重命名为标准格式
         original_video_path = task_dir / "original_video.mp4"
         shutil.move(download_result.file_path, original_video_path)
-        
+
+        # 按文件头确认下载到的是视频（而非错误页面或空文件），否则不必启动 ffmpeg
+        with open(original_video_path, "rb") as f:
+            if not looks_like_video(f.read(SNIFF_BYTES)):
+                raise ValueError("下载的文件不是支持的视频格式")
+
         task_logger.info(f"视频下载完成: {download_result.title}")
         task_manager.update_status(task_id, "processing")
 
         # 3. 启动视频处理工作流
-        workflow = VideoProcessingWorkflow(enable_multimodal=True, task_logger=task_logger, task_manager=task_manager, task_id=task_id)
+        workflow = get_workflow(enable_multimodal=True)
 
         # 执行处理
         workflow.process_video(
             video_path=str(original_video_path),
             output_dir=str(task_dir),
-            keep_temp=False
+            keep_temp=False,
+            task_id=task_id,
+            task_logger=task_logger,
+            task_manager=task_manager
         )
 
         # 处理完成
@@ -1,45 +1,52 @@
 """导出相关路由"""
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
-from services.task_manager import TaskManager
-from utils.file_utils import find_notes_file, ensure_markdown_file, create_multimodal_generator
-from markdown_pdf import MarkdownPdf, Section
+import re
+import uuid
+import asyncio
+import aiofiles
+import aiofiles.os
+from fastapi import APIRouter, HTTPException, Request
+from services.task_manager import get_task_manager
+from utils.file_utils import LargeFileResponse, find_notes_file, ensure_markdown_file, is_up_to_date, precompressed_file_response
+from services.multimodal_note_generator import export_to_markdown
 router = APIRouter(prefix="/api", tags=["export"])
 
+# Web 绝对路径图片 -> PDF 相对路径
+_WEB_IMG_PATTERN = re.compile(r'!\[([^\]]*)\]\(/storage/tasks/[^/]+/([^)]+)\)')
+
 # 全局任务管理器实例
-task_manager = TaskManager()
+task_manager = get_task_manager()
 
 
 @router.get("/export/{task_id}/markdown")
 async def export_markdown(task_id: str, force_regen: bool = False):
     """导出 Markdown 格式笔记（优先使用用户编辑版本）"""
-    task_manager.validate_task_completed(task_id)
+    await task_manager.avalidate_task_completed(task_id)
     task_dir = task_manager.get_task_dir(task_id)
     markdown_file = task_dir / "notes.md"
+    notes_file = find_notes_file(task_dir)
 
-    # 如果用户编辑的 notes.md 存在且不强制重新生成，直接返回
-    if markdown_file.exists() and not force_regen:
-        return FileResponse(
+    # notes.md 不早于笔记 JSON（含用户编辑版本）且不强制重新生成，直接返回
+    if not force_regen and markdown_file.exists() and (not notes_file or is_up_to_date(markdown_file, notes_file)):
+        return LargeFileResponse(
             path=str(markdown_file),
             filename=f"video_notes_{task_id}.md",
             media_type="text/markdown"
         )
 
     # 否则从 JSON 重新生成
-    notes_file = find_notes_file(task_dir)
     if not notes_file:
         raise HTTPException(status_code=404, detail="图文笔记文件不存在")
 
     # 生成 Markdown（Web版本，用于前端预览）
-    generator = create_multimodal_generator()
-    generator.export_to_markdown(
+    await asyncio.to_thread(
+        export_to_markdown,
         notes_json_path=str(notes_file),
         output_path=str(markdown_file),
         image_base_path=str(task_dir),
         for_web=True
     )
 
-    return FileResponse(
+    return LargeFileResponse(
         path=str(markdown_file),
         filename=f"video_notes_{task_id}.md",
         media_type="text/markdown"
@@ -47,45 +54,38 @@ async def export_markdown(task_id: str, force_regen: bool = False):
 
 
 @router.get("/export/{task_id}/json")
-async def export_json(task_id: str):
+async def export_json(task_id: str, request: Request):
     """导出原始 JSON 格式笔记"""
-    task_manager.validate_task_completed(task_id)
+    await task_manager.avalidate_task_completed(task_id)
     task_dir = task_manager.get_task_dir(task_id)
     
     notes_file = find_notes_file(task_dir)
     if not notes_file:
         raise HTTPException(status_code=404, detail="图文笔记文件不存在")
 
-    return FileResponse(
-        path=str(notes_file),
-        filename=f"video_notes_{task_id}.json",
-        media_type="application/json"
+    return precompressed_file_response(
+        request,
+        notes_file,
+        media_type="application/json",
+        filename=f"video_notes_{task_id}.json"
     )
 
 
 @router.get("/notes/{task_id}")
 async def get_notes(task_id: str):
     """获取笔记内容（优先返回用户编辑版本）"""
-    task_manager.validate_task_completed(task_id)
+    await task_manager.avalidate_task_completed(task_id)
     task_dir = task_manager.get_task_dir(task_id)
     markdown_file = task_dir / "notes.md"
-
-    # 如果用户编辑的 notes.md 存在，直接返回
-    if markdown_file.exists():
-        return FileResponse(
-            path=str(markdown_file),
-            media_type="text/markdown"
-        )
-
-    # 否则从 JSON 生成 markdown
     notes_file = find_notes_file(task_dir)
-    if not notes_file:
-        raise HTTPException(status_code=404, detail="图文笔记文件不存在")
 
-    # 确保 markdown 文件存在
-    markdown_file = ensure_markdown_file(task_dir, notes_file)
+    if notes_file:
+        # notes.md 不早于 JSON 时直接复用（含用户编辑版本），否则重新生成
+        markdown_file = await asyncio.to_thread(ensure_markdown_file, task_dir, notes_file)
+    elif not markdown_file.exists():
+        raise HTTPException(status_code=404, detail="图文笔记文件不存在")
 
-    return FileResponse(
+    return LargeFileResponse(
         path=str(markdown_file),
         media_type="text/markdown"
     )
@@ -94,7 +94,7 @@ async def get_notes(task_id: str):
 @router.put("/notes/{task_id}")
 async def save_notes(task_id: str, content: dict):
     """保存用户编辑的笔记内容"""
-    task_manager.validate_task_completed(task_id)
+    await task_manager.avalidate_task_completed(task_id)
 
     if "content" not in content:
         raise HTTPException(status_code=400, detail="缺少 content 字段")
@@ -102,95 +102,67 @@ async def save_notes(task_id: str, content: dict):
     task_dir = task_manager.get_task_dir(task_id)
     markdown_file = task_dir / "notes.md"
 
-    # 保存用户编辑的内容
+    # 保存用户编辑的内容：先写临时文件再原子替换，写入中途失败不会损坏已有笔记
+    tmp_file = markdown_file.with_name(f".{markdown_file.name}.{uuid.uuid4().hex}.tmp")
     try:
-        with open(markdown_file, "w", encoding="utf-8") as f:
-            f.write(content["content"])
+        async with aiofiles.open(tmp_file, "w", encoding="utf-8") as f:
+            await f.write(content["content"])
+        await aiofiles.os.replace(tmp_file, markdown_file)
 
         return {"message": "笔记保存成功", "task_id": task_id}
     except Exception as e:
+        tmp_file.unlink(missing_ok=True)
         raise HTTPException(status_code=500, detail=f"保存失败: {str(e)}")
 
 
 
 
 @router.get("/export/{task_id}/pdf")
-async def export_pdf(task_id: str):
+async def export_pdf(task_id: str, force_regen: bool = False):
     """导出 PDF 格式笔记（包含嵌入图片）"""
-    task_manager.validate_task_completed(task_id)
+    await task_manager.avalidate_task_completed(task_id)
     task_dir = task_manager.get_task_dir(task_id)
     markdown_file = task_dir / "notes.md"
+    notes_file = find_notes_file(task_dir)
 
-    # 确保 markdown 文件存在
-    if not markdown_file.exists():
-        notes_file = find_notes_file(task_dir)
-        if not notes_file:
-            raise HTTPException(status_code=404, detail="图文笔记文件不存在")
-        markdown_file = ensure_markdown_file(task_dir, notes_file)
-
-    # 优先使用用户编辑的 notes.md，保留用户的裁剪和编辑
-    if markdown_file.exists():
-        # 读取用户编辑的内容
-        with open(markdown_file, "r", encoding="utf-8") as f:
-            markdown_content = f.read()
-
-        # 将Web路径转换为PDF可用的相对路径
-        import re
-        # 转换绝对路径为相对路径
-        markdown_content = re.sub(
-            r'!\[([^\]]*)\]\(/storage/tasks/[^/]+/([^)]+)\)',
-            r'![\1](\2)',
-            markdown_content
-        )
-        temp_md_path = None  # 不需要临时文件
-    else:
-        # 如果用户没有编辑过，从JSON生成PDF专用内容
-        notes_file = find_notes_file(task_dir)
-        if not notes_file:
-            raise HTTPException(status_code=404, detail="图文笔记文件不存在")
-
-        generator = create_multimodal_generator()
-        import tempfile
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.md', delete=False, encoding='utf-8') as temp_md:
-            generator.export_to_markdown(
-                notes_json_path=str(notes_file),
-                output_path=temp_md.name,
-                image_base_path=str(task_dir),
-                for_web=False  # 使用相对路径，适合PDF生成
-            )
-            temp_md_path = temp_md.name
-
-        # 读取生成的markdown内容
-        with open(temp_md_path, "r", encoding="utf-8") as f:
-            markdown_content = f.read()
-
-    # 创建 PDF 文件路径
+    # 确保 markdown 文件存在且不早于笔记 JSON
+    if notes_file:
+        markdown_file = await asyncio.to_thread(ensure_markdown_file, task_dir, notes_file)
+    elif not markdown_file.exists():
+        raise HTTPException(status_code=404, detail="图文笔记文件不存在")
+
+    # PDF 不早于 notes.md 时直接返回已生成的文件
     pdf_file = task_dir / f"video_notes_{task_id}.pdf"
+    if not force_regen and is_up_to_date(pdf_file, markdown_file):
+        return _pdf_response(pdf_file, task_id)
 
+    # 读取 + 路径转换 + PDF 渲染都是阻塞操作，放到线程中执行
     try:
-        # 使用 markdown-pdf 生成 PDF
-        generate_pdf_with_markdown_pdf(markdown_content, str(pdf_file), task_dir)
-
+        await asyncio.to_thread(_render_pdf, markdown_file, pdf_file, task_dir)
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"PDF 生成失败: {str(e)}"
         )
-    finally:
-        # 清理临时文件（如果存在）
-        if temp_md_path:
-            import os
-            try:
-                os.unlink(temp_md_path)
-            except:
-                pass
 
     # 检查 PDF 文件是否成功创建
     if not pdf_file.exists():
         raise HTTPException(status_code=500, detail="PDF 文件创建失败")
 
     # 返回 PDF 文件
-    return FileResponse(
+    return _pdf_response(pdf_file, task_id)
+
+
+def _render_pdf(markdown_file, pdf_file, task_dir) -> None:
+    """读取 notes.md（保留用户的裁剪和编辑）并渲染为 PDF"""
+    markdown_content = markdown_file.read_text(encoding="utf-8")
+    # 将Web路径转换为PDF可用的相对路径
+    markdown_content = _WEB_IMG_PATTERN.sub(r'![\1](\2)', markdown_content)
+    generate_pdf_with_markdown_pdf(markdown_content, str(pdf_file), task_dir)
+
+
+def _pdf_response(pdf_file, task_id: str) -> LargeFileResponse:
+    return LargeFileResponse(
         path=str(pdf_file),
         filename=f"video_notes_{task_id}.pdf",
         media_type="application/pdf",
@@ -202,6 +174,8 @@ async def export_pdf(task_id: str):
 
 def generate_pdf_with_markdown_pdf(markdown_content: str, pdf_path: str, task_dir) -> None:
     """使用 markdown-pdf 生成 PDF"""
+    # 延迟导入：markdown_pdf 依赖 PyMuPDF，加载较慢，只在首次导出 PDF 时导入
+    from markdown_pdf import MarkdownPdf, Section
 
     # 创建 PDF 对象，支持目录和优化
     pdf = MarkdownPdf(toc_level=3, optimize=True)
@@ -1,113 +1,283 @@
 """处理相关路由"""
-import json
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from fastapi.responses import StreamingResponse
-from starlette.concurrency import run_in_threadpool
-
-from models.api_models import ProcessRequest
-from services.task_manager import TaskManager
-from services.video_processor import VideoProcessingWorkflow
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import aiofiles
+import orjson
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse, Response
+
+from models.api_models import BatchProcessRequest, ProcessRequest
+from services.task_manager import get_task_manager
+from services.video_processor import get_workflow, submit_job
 from services.summary_generator import Summarizer
 from utils.task_logger import TaskLogger
+from utils.file_utils import precompressed_file_response
 from settings import get_settings
 
 router = APIRouter(prefix="/api", tags=["process"])
 
 # 全局任务管理器实例
-task_manager = TaskManager()
+task_manager = get_task_manager()
 
 
-@router.post("/process/{task_id}")
-async def start_processing(task_id: str, request: ProcessRequest, background_tasks: BackgroundTasks):
-    """开始处理视频"""
+async def _start_task(task_id: str, request: ProcessRequest):
+    """校验任务状态并提交到后台处理，校验失败抛出 HTTPException"""
     try:
-        metadata = task_manager.load_metadata(task_id)
-    except:
+        metadata = await task_manager.aload_metadata(task_id)
+    except Exception:
         raise HTTPException(status_code=404, detail="任务不存在")
 
-    if metadata["status"] != "pending":
+    # 从中间阶段重跑时允许已结束的任务
+    allowed = ("pending",) if request.start_from == "extract_audio" else ("pending", "completed", "failed")
+    if metadata["status"] not in allowed:
         raise HTTPException(status_code=400, detail=f"任务状态错误: {metadata['status']}")
 
-    # 启动后台处理
-    background_tasks.add_task(
-        process_video_background,
-        task_id,
-        request.enable_multimodal,
-        request.keep_temp
-    )
+    # 先更新状态，避免后台任务快速失败后被覆盖为 processing
+    await asyncio.to_thread(task_manager.update_status, task_id, "processing")
+
+    # 提交到专用线程池执行，不占用事件循环
+    submit_job(process_video_job, task_id, request.enable_multimodal, request.keep_temp, request.start_from)
+
+
+# 需注册在 /process/{task_id} 之前，否则 "batch" 会被当作任务ID
+@router.post("/process/batch")
+async def start_batch_processing(request: BatchProcessRequest):
+    """批量开始处理多个任务：共用同一个工作流实例与后台线程池（并发数由 MAX_CONCURRENT_TASKS 限制）"""
+    if not request.task_ids:
+        raise HTTPException(status_code=400, detail="task_ids 不能为空")
 
-    # 更新状态
-    task_manager.update_status(task_id, "processing")
+    started, errors = [], {}
+    for task_id in dict.fromkeys(request.task_ids):
+        try:
+            await _start_task(task_id, request)
+            started.append(task_id)
+        except HTTPException as e:
+            errors[task_id] = e.detail
 
+    return {"message": f"已开始处理 {len(started)} 个任务", "started": started, "errors": errors}
+
+
+@router.post("/process/{task_id}")
+async def start_processing(task_id: str, request: ProcessRequest):
+    """开始处理视频"""
+    await _start_task(task_id, request)
     return {"message": "处理已开始", "task_id": task_id}
 
 
+# 状态轮询的短期缓存: task_id -> (过期时间, 响应体)；多个客户端同时轮询时共享一次读取与编码
+# 每次写入都移到末尾且 TTL 相同，因此开头的条目最早过期：写入时从开头淘汰已过期及超出上限的条目
+_STATUS_TTL = 0.2
+_STATUS_CACHE_MAX = 1024
+_status_cache: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+
 @router.get("/status/{task_id}")
 async def get_task_status(task_id: str):
     """获取任务状态"""
+    now = time.monotonic()
+    cached = _status_cache.get(task_id)
+    if cached is not None and cached[0] > now:
+        return Response(content=cached[1], media_type="application/json")
+
     try:
-        metadata = task_manager.load_metadata(task_id)
-        return metadata
-    except:
+        metadata = await task_manager.aload_metadata(task_id)
+    except Exception:
         raise HTTPException(status_code=404, detail="任务不存在")
 
+    body = orjson.dumps(metadata)
+    _status_cache[task_id] = (now + _STATUS_TTL, body)
+    _status_cache.move_to_end(task_id)
+    while _status_cache:
+        expires, _ = next(iter(_status_cache.values()))
+        if expires > now and len(_status_cache) <= _STATUS_CACHE_MAX:
+            break
+        _status_cache.popitem(last=False)
+    return Response(content=body, media_type="application/json")
+
+
+# 推送流在无本进程通知时重新检查元数据的间隔（多 worker 部署时任务可能在其他进程中更新）
+_STREAM_RECHECK = 2.0
+# 无数据推送时发送注释行保活的间隔，避免被代理当作空闲连接断开
+_STREAM_KEEPALIVE = 15.0
+
+
+async def _status_events(task_id: str, metadata: dict):
+    """状态推送生成器：元数据有变化时推送一条 SSE 消息，任务结束后关闭"""
+    event = task_manager.subscribe(task_id)
+    try:
+        last_body, last_sent = None, time.monotonic()
+        while True:
+            body = orjson.dumps(metadata)
+            if body != last_body:
+                yield b"data: " + body + b"\n\n"
+                last_body, last_sent = body, time.monotonic()
+            if metadata["status"] in ("completed", "failed"):
+                break
+            try:
+                await asyncio.wait_for(event.wait(), timeout=_STREAM_RECHECK)
+            except asyncio.TimeoutError:
+                if time.monotonic() - last_sent >= _STREAM_KEEPALIVE:
+                    yield b": keep-alive\n\n"
+                    last_sent = time.monotonic()
+            # 先清除再读取，读取期间发生的更新会让下一轮等待立即返回
+            event.clear()
+            try:
+                metadata = await task_manager.aload_metadata(task_id)
+            except HTTPException:
+                break  # 任务已被删除
+    finally:
+        task_manager.unsubscribe(task_id, event)
+
+
+@router.get("/status/{task_id}/stream")
+async def stream_task_status(task_id: str):
+    """以 SSE 推送任务状态，代替轮询 /status/{task_id}"""
+    try:
+        metadata = await task_manager.aload_metadata(task_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    return StreamingResponse(
+        _status_events(task_id, metadata),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # 禁用nginx缓冲
+        }
+    )
+
+
+def _raw_json_response(fields: dict, raw: dict) -> Response:
+    """将磁盘上已序列化的JSON原样拼接进响应体，避免解析后再编码一遍
+
+    fields 为普通字段，raw 为 字段名 -> JSON字节
+    """
+    body = orjson.dumps(fields)[:-1]
+    for key, data in raw.items():
+        body += b"," + orjson.dumps(key) + b":" + data
+    return Response(content=body + b"}", media_type="application/json")
+
+
+# 结果名 -> 候选文件（按顺序查找，multimodal_notes 兼容嵌套目录）
+_RESULT_FILES = {
+    "asr_result": ("asr_result.json",),
+    "merged_text": ("merged_text.json",),
+    "summary": ("summary.json",),
+    "multimodal_notes": ("multimodal_notes.json", "multimodal_notes/multimodal_notes.json"),
+}
+
+
+# 合并后的结果体 LRU 缓存: task_id -> (各文件版本, JSON字节)
+_RESULTS_CACHE_MAX = 128
+_results_cache: "OrderedDict[str, Tuple[tuple, bytes]]" = OrderedDict()
+
+
+def _file_version(path) -> Tuple[int, int]:
+    st = path.stat()
+    return st.st_mtime_ns, st.st_size
+
+
+async def _read_bytes(path) -> bytes:
+    async with aiofiles.open(path, "rb") as f:
+        return await f.read()
+
+
+async def _read_json_bytes(path) -> bytes:
+    """读取结果文件并校验是合法 JSON（原样拼接进响应体前，避免空文件或写了一半的文件产生非法响应）"""
+    data = await _read_bytes(path)
+    try:
+        orjson.loads(data)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=500, detail=f"结果文件损坏: {path.name}")
+    return data
+
+
+def _find_result_file(task_dir, name: str):
+    for filename in _RESULT_FILES[name]:
+        path = task_dir / filename
+        if path.exists():
+            return path
+    return None
+
 
 @router.get("/results/{task_id}")
-async def get_results(task_id: str):
-    """获取处理结果"""
-    metadata = task_manager.validate_task_completed(task_id)
+async def get_results(task_id: str, embed: bool = True):
+    """获取处理结果；embed=false 时只返回各结果文件的地址清单"""
+    metadata = await task_manager.avalidate_task_completed(task_id)
     task_dir = task_manager.get_task_dir(task_id)
-    results = {}
 
     # 收集所有结果文件
-    result_files = {
-        "asr_result": "asr_result.json",
-        "merged_text": "merged_text.json",
-        "summary": "summary.json",
-        "multimodal_notes": "multimodal_notes.json"
-    }
-
-    for key, filename in result_files.items():
-        file_path = task_dir / filename
-        alt_path = None
-        # 针对 multimodal_notes，优先兼容嵌套目录
-        if key == "multimodal_notes" and not file_path.exists():
-            alt_path = task_dir / "multimodal_notes" / "multimodal_notes.json"
-        target_path = file_path if file_path.exists() else alt_path
-        if target_path and target_path.exists():
-            with open(target_path, "r", encoding="utf-8") as f:
-                results[key] = json.load(f)
-
-    return {
-        "task_id": task_id,
-        "status": metadata["status"],
-        "results": results
-    }
+    paths = {}
+    for key in _RESULT_FILES:
+        path = _find_result_file(task_dir, key)
+        if path:
+            paths[key] = path
+
+    if not embed:
+        return {
+            "task_id": task_id,
+            "status": metadata["status"],
+            "files": {key: f"/api/results/{task_id}/{key}" for key in paths}
+        }
+
+    # 已完成任务的结果基本不变：按各文件 (mtime, size) 校验缓存，命中时只需 stat 不再读盘
+    version = tuple((key, *_file_version(p)) for key, p in paths.items())
+    cached = _results_cache.get(task_id)
+    if cached is not None and cached[0] == version:
+        _results_cache.move_to_end(task_id)
+        results_body = cached[1]
+    else:
+        # 各结果文件并发读取，整体耗时取决于最慢的一个而非总和
+        contents = await asyncio.gather(*(_read_json_bytes(p) for p in paths.values()))
+        results_body = b"{" + b",".join(orjson.dumps(k) + b":" + data for k, data in zip(paths, contents)) + b"}"
+        _results_cache[task_id] = (version, results_body)
+        _results_cache.move_to_end(task_id)
+        if len(_results_cache) > _RESULTS_CACHE_MAX:
+            _results_cache.popitem(last=False)
+
+    return _raw_json_response(
+        {"task_id": task_id, "status": metadata["status"]},
+        {"results": results_body}
+    )
 
 
 @router.get("/results/{task_id}/asr")
 async def get_asr_result(task_id: str):
     """返回 ASR 转录数据"""
     try:
-        task_manager.load_metadata(task_id)
+        await task_manager.aload_metadata(task_id)
         task_dir = task_manager.get_task_dir(task_id)
         asr_file = task_dir / "asr_result.json"
         if not asr_file.exists():
             raise HTTPException(status_code=404, detail="ASR 转录尚未生成")
-        with open(asr_file, "r", encoding="utf-8") as f:
-            return {"task_id": task_id, "data": json.load(f)}
+        return _raw_json_response({"task_id": task_id}, {"data": await _read_json_bytes(asr_file)})
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"读取 ASR 失败: {str(e)}")
 
 
+@router.get("/results/{task_id}/{name}")
+async def get_result_file(task_id: str, name: str, request: Request):
+    """直接返回单个结果文件（sendfile 零拷贝，不经过解析和重新编码；支持预压缩的 .gz）"""
+    if name not in _RESULT_FILES:
+        raise HTTPException(status_code=404, detail=f"未知的结果类型: {name}")
+    await task_manager.avalidate_task_completed(task_id)
+    path = _find_result_file(task_manager.get_task_dir(task_id), name)
+    if not path:
+        raise HTTPException(status_code=404, detail=f"结果文件不存在: {name}")
+    return precompressed_file_response(request, path, media_type="application/json")
+
+
 @router.get("/stream-summary/{task_id}")
 async def stream_full_summary(task_id: str):
     """流式生成视频全文摘要"""
     try:
         # 验证任务存在
-        task_manager.load_metadata(task_id)
+        await task_manager.aload_metadata(task_id)
         task_dir = task_manager.get_task_dir(task_id)
         asr_file = task_dir / "asr_result.json"
 
@@ -136,8 +306,8 @@ async def stream_full_summary(task_id: str):
         raise HTTPException(status_code=500, detail=f"生成摘要失败: {str(e)}")
 
 
-async def process_video_background(task_id: str, enable_multimodal: bool, keep_temp: bool):
-    """后台处理视频的函数"""
+def process_video_job(task_id: str, enable_multimodal: bool, keep_temp: bool, start_from: str = "extract_audio"):
+    """后台处理视频的函数（在专用线程池中执行）"""
     task_logger = None
     try:
         task_dir = task_manager.get_task_dir(task_id)
@@ -146,15 +316,18 @@ async def process_video_background(task_id: str, enable_multimodal: bool, keep_t
         # 获取任务专用logger
         task_logger = TaskLogger.get_logger(task_id, str(task_dir))
 
-        # 创建工作流实例
-        workflow = VideoProcessingWorkflow(enable_multimodal=enable_multimodal, task_logger=task_logger, task_manager=task_manager, task_id=task_id)
+        # 复用进程内共享的工作流实例
+        workflow = get_workflow(enable_multimodal)
 
         # 执行处理
-        result = await run_in_threadpool(
-            workflow.process_video,
+        result = workflow.process_video(
             video_path=str(video_path),
             output_dir=str(task_dir),
-            keep_temp=keep_temp
+            keep_temp=keep_temp,
+            task_id=task_id,
+            task_logger=task_logger,
+            task_manager=task_manager,
+            start_from=start_from
         )
 
         # 处理完成
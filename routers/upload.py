@@ -1,28 +1,110 @@
 """上传相关路由"""
+import os
 import shutil
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from services.task_manager import TaskManager
+import asyncio
+from pathlib import Path
+
+import aiofiles
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
+from services.task_manager import get_task_manager
+from services.ffmpeg_process import SNIFF_BYTES, looks_like_video
+from utils.uring_io import get_engine, copy_stream
+from settings import get_settings
 
 router = APIRouter(prefix="/api", tags=["upload"])
 
 # 全局任务管理器实例
-task_manager = TaskManager()
+task_manager = get_task_manager()
+
+# 允许的视频后缀（小写，含点），模块加载时构建一次
+_ALLOWED_EXT = frozenset(f".{ext.lower().lstrip('.')}" for ext in get_settings().ALLOWED_EXTS)
+# 上传写盘的分块大小
+_CHUNK_SIZE = 1 << 20
+# 上传大小上限（字节）
+_MAX_UPLOAD_BYTES = get_settings().MAX_UPLOAD_SIZE_MB * 1024 * 1024
+# sendfile 不可用时 copyfileobj 的缓冲区大小
+_COPY_BUFSIZE = 4 << 20
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"文件超过 {get_settings().MAX_UPLOAD_SIZE_MB}MB 限制")
+
+
+def _copy_from_disk(src, video_path: Path) -> int:
+    """上传临时文件已落盘：sendfile 在内核态拷贝，不可用时退回大缓冲区 copyfileobj；返回写入字节数"""
+    src.seek(0)
+    with open(video_path, "wb") as dst:
+        try:
+            size = os.fstat(src.fileno()).st_size
+            if size > _MAX_UPLOAD_BYTES:
+                raise _too_large()
+            offset = 0
+            while offset < size:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except (AttributeError, OSError):
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+            shutil.copyfileobj(src, dst, _COPY_BUFSIZE)
+        return dst.tell()
+
+
+async def _save_upload(file: UploadFile, video_path: Path):
+    """分块异步写盘，避免大文件拷贝阻塞事件循环"""
+    # 显式启用 io_uring 时优先使用（无论上传是否已转存到磁盘）
+    if engine := get_engine():
+        written = await asyncio.to_thread(copy_stream, engine, file.file, video_path, _CHUNK_SIZE)
+    # SpooledTemporaryFile 超过阈值后已转存到磁盘；未转存时调用 fileno() 会强制落盘，需先判断
+    elif getattr(file.file, "_rolled", False):
+        written = await asyncio.to_thread(_copy_from_disk, file.file, video_path)
+    else:
+        # 边写边累计字节数，超限立即中止
+        written = 0
+        async with aiofiles.open(video_path, "wb") as buffer:
+            while chunk := await file.read(_CHUNK_SIZE):
+                written += len(chunk)
+                if written > _MAX_UPLOAD_BYTES:
+                    raise _too_large()
+                await buffer.write(chunk)
+    if written > _MAX_UPLOAD_BYTES:
+        raise _too_large()
 
 
 @router.post("/upload")
-async def upload_video(file: UploadFile = File(...)):
+async def upload_video(request: Request, file: UploadFile = File(...)):
     """上传视频文件"""
-    if not file.filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.webm')):
+    # Content-Length 含 multipart 边界等开销，预留一个分块的余量
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > _MAX_UPLOAD_BYTES + _CHUNK_SIZE:
+        raise _too_large()
+    if Path(file.filename or "").suffix.lower() not in _ALLOWED_EXT:
         raise HTTPException(status_code=400, detail="不支持的视频格式")
+    # 校验通过后再创建任务，被拒绝的上传不会留下空任务目录
+    if file.size is not None and file.size > _MAX_UPLOAD_BYTES:
+        raise _too_large()
+    # 按文件头识别容器格式，不信任后缀（空文件、改名的网页等直接拒绝）
+    head = await file.read(SNIFF_BYTES)
+    await file.seek(0)
+    if not looks_like_video(head):
+        raise HTTPException(status_code=400, detail="文件内容不是支持的视频格式")
 
     # 创建任务
     task_id = task_manager.create_task(file.filename)
     task_dir = task_manager.get_task_dir(task_id)
 
-    # 保存上传的文件
+    # 保存上传的文件，失败时清理任务目录
     video_path = task_dir / "original_video.mp4"
-    with open(video_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    try:
+        await _save_upload(file, video_path)
+    except HTTPException:
+        task_manager.delete_task(task_id)
+        raise
+    except Exception as e:
+        task_manager.delete_task(task_id)
+        raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
 
     return {
         "task_id": task_id,
@@ -3,6 +3,7 @@ import logging
 from pathlib import Path
 from typing import Dict, Optional
 import json
+import orjson
 from agno.agent import Agent
 from agno.knowledge.text import TextKnowledgeBase
 from agno.vectordb.lancedb import LanceDb
@@ -86,8 +87,7 @@ class VideoNotesAgentService:
                 return self.knowledge_bases[task_id]
 
             # 读取并转换JSON数据
-            with open(notes_path, 'r', encoding='utf-8') as f:
-                json_data = json.load(f)
+            json_data = orjson.loads(notes_path.read_bytes())
 
             # 转换为文本格式
             text_content = self._convert_json_to_text(json_data)
@@ -2,14 +2,23 @@
 """
 ASR 服务模块 - 封装腾讯云语音识别功能
 """
-import json
+import io
+import logging
 import os
+import wave
 import asyncio
-from typing import Optional, Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple, Union
 from pathlib import Path
 
+import orjson
+
 from . import credential
 from . import flash_recognizer
+from ..ffmpeg_process import detect_silences
+from utils.io_utils import atomic_write
+
+logger = logging.getLogger(__name__)
 
 
 class ASRService:
@@ -19,9 +28,15 @@ class ASRService:
                  appid: str,
                  secret_id: str, 
                  secret_key: str,
-                 engine_type: str = "16k_zh"):
+                 engine_type: str = "16k_zh",
+                 chunk_seconds: int = 0,
+                 concurrency: int = 1,
+                 ffmpeg_path: str = "ffmpeg"):
         """
         初始化 ASR 服务
+
+        chunk_seconds > 0 时，超过该时长的 WAV 按静音点切分为多个分片，
+        以 concurrency 个线程并发识别后按时间偏移合并（识别主要是网络等待）。
         """
         if not appid:
             raise ValueError("APPID 不能为空")
@@ -34,10 +49,13 @@ class ASRService:
         self.secret_id = secret_id
         self.secret_key = secret_key
         self.engine_type = engine_type
+        self.chunk_seconds = chunk_seconds
+        self.concurrency = max(1, concurrency)
+        self.ffmpeg_path = ffmpeg_path
         
         # 初始化认证和识别器
         self.credential_var = credential.Credential(secret_id, secret_key)
-        self.recognizer = flash_recognizer.FlashRecognizer(appid, self.credential_var)
+        self.recognizer = flash_recognizer.FlashRecognizer(appid, self.credential_var, pool_size=self.concurrency)
     
     def _create_request(self) -> flash_recognizer.FlashRecognitionRequest:
         """创建识别请求对象"""
@@ -51,54 +69,120 @@ class ASRService:
         return req
     
     def transcribe_audio(self, 
-                        audio_path: str, 
+                        audio: Union[str, bytes], 
                         output_path: Optional[str] = None) -> str:
         """
         转录音频文件
+
+        audio 为 WAV 文件路径，或已在内存中的 WAV 字节（如 ffmpeg 管道输出）。
         """
-        if not os.path.exists(audio_path):
-            raise FileNotFoundError(f"音频文件不存在: {audio_path}")
-        
-        if output_path is None:
-            output_path = f"{Path(audio_path).stem}_asr.json"
-        
-        # 创建识别请求
-        req = self._create_request()
+        if isinstance(audio, bytes):
+            if output_path is None:
+                output_path = "audio_asr.json"
+        else:
+            if not os.path.exists(audio):
+                raise FileNotFoundError(f"音频文件不存在: {audio}")
+            if output_path is None:
+                output_path = f"{Path(audio).stem}_asr.json"
         
         try:
-            # 读取音频数据
-            with open(audio_path, 'rb') as f:
-                data = f.read()
-            
-            # 执行识别
-            result_data = self.recognizer.recognize(req, data)
-            resp = json.loads(result_data)
-            
-            # 检查响应状态
-            request_id = resp.get("request_id", "")
-            code = resp.get("code", -1)
-            
-            if code != 0:
-                message = resp.get("message", "未知错误")
-                raise RuntimeError(f"ASR识别失败 - request_id: {request_id}, code: {code}, message: {message}")
-            
-            # 提取句子信息
-            sentences = self._extract_sentences(resp)
+            chunks = self._split_audio(audio)
+            if chunks is None:
+                # 整段识别
+                if isinstance(audio, bytes):
+                    sentences = self._recognize(audio)
+                else:
+                    with open(audio, 'rb') as f:
+                        sentences = self._recognize(f.read())
+            else:
+                # 分片并发识别，map 保持分片顺序
+                with ThreadPoolExecutor(max_workers=min(self.concurrency, len(chunks)),
+                                        thread_name_prefix="asr-chunk") as executor:
+                    results = list(executor.map(lambda c: self._recognize(c[1]), chunks))
+                sentences = []
+                for (offset_ms, _), chunk_sentences in zip(chunks, results):
+                    for sentence in chunk_sentences:
+                        sentence["start_time"] += offset_ms
+                        sentence["end_time"] += offset_ms
+                        sentences.append(sentence)
             
             # 保存结果
-            with open(output_path, "w", encoding="utf-8") as f:
-                json.dump(sentences, f, ensure_ascii=False, indent=4)
+            with atomic_write(output_path, "wb") as f:
+                f.write(orjson.dumps(sentences, option=orjson.OPT_INDENT_2))
             
-            print(f"ASR转录完成: {output_path}")
+            logger.info("ASR转录完成: %s", output_path)
             return output_path
 
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             raise RuntimeError(f"ASR响应解析失败: {e}")
         except IOError as e:
             raise RuntimeError(f"文件操作失败: {e}")
         except Exception as e:
             raise RuntimeError(f"ASR转录失败: {e}")
 
+    def warmup(self) -> None:
+        """预热连接（只做 TCP/TLS 握手，不提交识别，不产生费用）"""
+        self.recognizer.warmup()
+
+    def _recognize(self, data: bytes) -> List[Dict[str, Any]]:
+        """识别一段音频数据，返回句子列表"""
+        req = self._create_request()
+        result_data = self.recognizer.recognize(req, data)
+        resp = orjson.loads(result_data)
+
+        # 检查响应状态
+        request_id = resp.get("request_id", "")
+        code = resp.get("code", -1)
+
+        if code != 0:
+            message = resp.get("message", "未知错误")
+            raise RuntimeError(f"ASR识别失败 - request_id: {request_id}, code: {code}, message: {message}")
+
+        # 提取句子信息
+        return self._extract_sentences(resp)
+
+    def _split_audio(self, audio: Union[str, bytes]) -> Optional[List[Tuple[int, bytes]]]:
+        """按静音点把 WAV 切成不超过 chunk_seconds 的分片，返回 [(起始毫秒, 分片WAV字节)]；无需切分时返回 None"""
+        if self.chunk_seconds <= 0 or self.concurrency <= 1:
+            return None
+        try:
+            with wave.open(io.BytesIO(audio) if isinstance(audio, bytes) else audio, "rb") as w:
+                params = w.getparams()
+                rate = w.getframerate()
+                duration = w.getnframes() / rate
+                if duration <= self.chunk_seconds:
+                    return None
+
+                # 提取音频时已顺带检测过静音的，直接复用
+                silences = getattr(audio, "silences", None)
+                if silences is None:
+                    silences = detect_silences(audio, self.ffmpeg_path)
+                cuts = self._plan_cuts(duration, silences)
+
+                chunks = []
+                for start, end in zip([0.0] + cuts, cuts + [duration]):
+                    w.setpos(int(start * rate))
+                    frames = w.readframes(int(end * rate) - int(start * rate))
+                    buf = io.BytesIO()
+                    with wave.open(buf, "wb") as out:
+                        out.setparams(params)
+                        out.writeframes(frames)
+                    chunks.append((int(start * 1000), buf.getvalue()))
+                return chunks
+        except (wave.Error, EOFError):
+            return None  # 非 PCM WAV，整段识别
+
+    def _plan_cuts(self, duration: float, silences: List[Tuple[float, float]]) -> List[float]:
+        """选择切分点：每个分片优先在后半段最后一个静音中点切开，找不到则在上限处硬切"""
+        midpoints = [(s + e) / 2 for s, e in silences]
+        cuts, start = [], 0.0
+        while duration - start > self.chunk_seconds:
+            limit = start + self.chunk_seconds
+            candidates = [m for m in midpoints if start + self.chunk_seconds / 2 < m <= limit]
+            start = candidates[-1] if candidates else limit
+            cuts.append(start)
+        return cuts
+
     async def transcribe_audio_async(self,
                                    audio_path: str,
                                    output_path: Optional[str] = None) -> str:
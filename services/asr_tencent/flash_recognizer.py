@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import requests
+from requests.adapters import HTTPAdapter
 import hmac
 import hashlib
 import base64
@@ -102,9 +103,12 @@ class FlashRecognizer:
     stable_flag：     Integer 
     '''
 
-    def __init__(self, appid, credential):
+    def __init__(self, appid, credential, pool_size=4):
         self.credential = credential
         self.appid = appid
+        # 复用 TCP/TLS 连接：分片并发识别时每个请求不再重新握手；连接池不小于并发数
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size)))
 
     def _format_sign_string(self, param):
         signstr = "POSTasr.cloud.tencent.com/asr/flash/v1/"
@@ -171,9 +175,16 @@ class FlashRecognizer:
         query_arr['sentence_max_length'] = req.sentence_max_length
         return query_arr
 
+    def warmup(self, timeout=5):
+        """预先建立到识别服务的连接并放入连接池，失败忽略"""
+        try:
+            self.session.head("https://asr.cloud.tencent.com/", timeout=timeout)
+        except requests.RequestException:
+            pass
+
     def recognize(self, req, data):
         header = self._build_header()
         query_arr = self._create_query_arr(req)
         req_url = self._build_req_with_signature(self.credential.secret_key, query_arr, header)
-        r = requests.post(req_url, headers=header, data=data)
+        r = self.session.post(req_url, headers=header, data=data)
         return r.text
@@ -1,24 +1,51 @@
-import os,subprocess,tempfile,urllib.request,urllib.parse
+import os,re,heapq,struct,queue,bisect,shutil,logging,threading,subprocess,tempfile,urllib.request,urllib.parse
+from collections import deque
+from functools import lru_cache
 from pathlib import Path
-from typing import Union,Tuple,Optional,List
+from typing import Union,Tuple,Optional,List,Iterator
+import orjson
+
+logger=logging.getLogger(__name__)
+_VIDEO_EXTS=frozenset({'.mp4','.avi','.mov','.mkv','.webm'})
+# 后台线程中运行：不读 stdin（避免被终端挂起或吞掉输入），只输出错误，减少 stderr 管道数据量
+_QUIET=("-nostdin","-hide_banner","-loglevel","error")
+# ISO BMFF（mp4/mov）文件开头可能出现的顶层 box 类型
+_BMFF_BOXES=frozenset({b"ftyp",b"moov",b"mdat",b"free",b"skip",b"wide",b"pnot"})
+SNIFF_BYTES=12
+
+def looks_like_video(head:bytes)->bool:
+    """根据文件头 SNIFF_BYTES 字节判断是否为支持的视频容器（mp4/mov、avi、mkv/webm），不调用 ffmpeg"""
+    if len(head)<SNIFF_BYTES:return False
+    if head[4:8] in _BMFF_BOXES:return True
+    if head[:4]==b"RIFF" and head[8:12]==b"AVI ":return True
+    return head[:4]==b"\x1aE\xdf\xa3"
+
+@lru_cache(maxsize=None)
+def resolve_binary(name:str)->str:
+    """解析可执行文件的绝对路径（每个名字只查找一次 PATH），找不到时原样返回"""
+    return shutil.which(name) or name
+
+@lru_cache(maxsize=None)
+def _ffmpeg_available(ffmpeg:str)->bool:
+    try:subprocess.run([ffmpeg,"-version"],capture_output=True,check=True);return True
+    except (OSError,subprocess.CalledProcessError):return False
 
 class VideoProcessor:
     """视频处理器：支持文件上传和链接解析，实现音视频分流"""
 
     def __init__(self,ffmpeg_path:str="ffmpeg"):
-        self.ffmpeg=ffmpeg_path
+        self.ffmpeg=resolve_binary(ffmpeg_path)
         self._check_ffmpeg()
 
     def _check_ffmpeg(self):
-        """检查ffmpeg可用性"""
-        try:subprocess.run([self.ffmpeg,"-version"],capture_output=True,check=True)
-        except:raise RuntimeError("ffmpeg not found")
+        """检查ffmpeg可用性（结果按路径缓存）"""
+        if not _ffmpeg_available(self.ffmpeg):raise RuntimeError("ffmpeg not found")
 
     def _download_video(self,url:str,output_dir:str)->str:
         """下载视频到临时目录"""
         parsed=urllib.parse.urlparse(url)
         fname=Path(parsed.path).name or "video.mp4"
-        if not fname.endswith(('.mp4','.avi','.mov','.mkv','.webm')):fname+=".mp4"
+        if Path(fname).suffix.lower() not in _VIDEO_EXTS:fname+=".mp4"
 
         output_path=os.path.join(output_dir,fname)
         urllib.request.urlretrieve(url,output_path)
@@ -80,10 +107,10 @@ class VideoProcessor:
         duration = end_time - start_time
         output_pattern = os.path.join(output_dir, "frame_%06d.jpg")
 
-        cmd=[self.ffmpeg,"-ss",str(start_time),"-i",video_path,"-t",str(duration),"-vf",f"fps={fps},scale=-1:360","-q:v","5","-y",output_pattern]
+        cmd=[self.ffmpeg,*_QUIET,"-ss",str(start_time),"-i",video_path,"-t",str(duration),"-vf",f"fps={fps},scale=-1:360","-q:v","5","-y",output_pattern]
 
         try:
-            subprocess.run(cmd, capture_output=True, check=True, text=True)
+            subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, check=True, text=True)
         except subprocess.CalledProcessError as e:
             raise RuntimeError(f"ffmpeg failed: {e.stderr}")
 
@@ -98,6 +125,83 @@ class VideoProcessor:
 
         return frame_files
 
+    def _batch_cmd(self,video_path:str,ranges:List[Tuple[float,float,float]],out:List[str])->Tuple[List[str],float]:
+        """构造批量抽帧命令，返回 (命令, 起始偏移秒数)"""
+        # 输入端 -ss 快速定位到最早的段，滤镜中的 t 从 0 开始，因此各段时间换算为相对 base
+        base=min(s for s,_,_ in ranges);stop=max(e for _,e,_ in ranges)
+        expr="+".join(f"between(t,{s-base:.3f},{e-base:.3f})*(isnan(prev_selected_t)+gte(t-prev_selected_t,{1/fps:.3f}))"
+                      for s,e,fps in ranges)
+        # showinfo 以 info 级别输出，不能使用 _QUIET
+        return [self.ffmpeg,"-nostdin","-hide_banner","-nostats","-ss",f"{base:.3f}","-i",video_path,"-t",f"{stop-base:.3f}",
+                "-vf",f"select='{expr}',showinfo,scale=-1:360","-vsync","0","-q:v","5",*out],base
+
+    def extract_frames_batch(self,video_path:str,ranges:List[Tuple[float,float,float]],output_dir:Optional[str]=None)->List[list]:
+        """一次 ffmpeg 调用抽取多个时间段的帧，只启动一个进程、解析一次容器
+
+        ranges 为 (开始秒, 结束秒, fps)；select 滤镜按各段自己的间隔选帧，showinfo 输出每帧时间戳，
+        据此把帧分回各段。返回与 ranges 一一对应的列表（某段无帧时为空列表）：
+        指定 output_dir 时元素为写入的 JPEG 路径；否则经 stdout 以 MJPEG 流输出，元素为内存中的 JPEG 字节，不落盘。
+        """
+        if not os.path.exists(video_path):raise FileNotFoundError(f"Video file not found: {video_path}")
+        if not ranges:return []
+        if not output_dir:
+            out=[[] for _ in ranges]
+            for i,jpegs in self.iter_frames_batch(video_path,ranges):out[i]=jpegs
+            return out
+        os.makedirs(output_dir,exist_ok=True)
+        cmd,base=self._batch_cmd(video_path,ranges,[os.path.join(output_dir,"frame_%06d.jpg"),"-y"])
+        r=subprocess.run(cmd,stdin=subprocess.DEVNULL,capture_output=True)
+        stderr=r.stderr.decode(errors="replace")
+        if r.returncode!=0:raise RuntimeError(f"ffmpeg failed: {stderr[-2000:]}")
+
+        times=[base+float(t) for t in _SHOWINFO_RE.findall(stderr)]
+        frames=[os.path.join(output_dir,f) for f in sorted(os.listdir(output_dir)) if f.startswith("frame_") and f.endswith(".jpg")]
+        if len(frames)!=len(times):logger.warning("帧数与时间戳数不一致: %d / %d",len(frames),len(times))
+        return bucket_by_time(frames,times,[(s,e) for s,e,_ in ranges])
+
+    def iter_frames_batch(self,video_path:str,ranges:List[Tuple[float,float,float]])->Iterator[Tuple[int,List[bytes]]]:
+        """与 extract_frames_batch 相同的单进程抽帧，但边解码边产出：某段的帧一旦收齐（帧时间越过段尾）就立即产出
+        (段下标, JPEG 字节列表)，调用方可在 ffmpeg 继续解码后续段的同时处理已完成的段。
+
+        消费方暂停读取时管道写满，ffmpeg 自然阻塞等待，无需额外暂停/恢复进程；提前关闭生成器会终止 ffmpeg。
+        ffmpeg 异常退出时在已产出的段之后抛出 RuntimeError。
+        """
+        if not os.path.exists(video_path):raise FileNotFoundError(f"Video file not found: {video_path}")
+        if not ranges:return
+        cmd,base=self._batch_cmd(video_path,ranges,["-f","image2pipe","-c:v","mjpeg","pipe:1"])
+        proc=subprocess.Popen(cmd,stdin=subprocess.DEVNULL,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        # showinfo 时间戳与 stdout 的帧按顺序一一对应；后台线程持续读 stderr，避免管道写满阻塞 ffmpeg
+        times:"queue.SimpleQueue[Optional[float]]"=queue.SimpleQueue();tail=deque(maxlen=50)
+        def read_stderr():
+            for line in proc.stderr:
+                line=line.decode(errors="replace")
+                if m:=_SHOWINFO_RE.search(line):times.put(base+float(m.group(1)))
+                else:tail.append(line)
+            times.put(None)
+        reader=threading.Thread(target=read_stderr,name="ffmpeg-showinfo",daemon=True);reader.start()
+
+        order=sorted(range(len(ranges)),key=lambda i:ranges[i][0])
+        starts=[ranges[i][0] for i in order]
+        out=[[] for _ in ranges];pending=[(e,i) for i,(_,e,_) in enumerate(ranges)];heapq.heapify(pending)
+        try:
+            for n,jpeg in enumerate(iter_mjpeg(proc.stdout)):
+                t=times.get()
+                if t is None:
+                    # 读完剩余输出再等待退出，否则 ffmpeg 会阻塞在写满的管道上
+                    logger.warning("帧数多于时间戳数，丢弃第 %d 帧之后的帧",n);proc.stdout.read();break
+                k=_range_of(t,order,starts,ranges)
+                if k>=0:out[k].append(jpeg)
+                # 帧按时间递增输出，段尾早于当前帧时间的段不会再有新帧
+                while pending and pending[0][0]<t:
+                    i=heapq.heappop(pending)[1];yield i,out[i];out[i]=[]
+            proc.wait();reader.join()
+            if proc.returncode!=0:raise RuntimeError(f"ffmpeg failed: {''.join(tail)[-2000:]}")
+            while pending:
+                i=heapq.heappop(pending)[1];yield i,out[i]
+        finally:
+            if proc.poll() is None:proc.kill();proc.wait()
+            proc.stdout.close();proc.stderr.close()
+
     def process_file(self,file_path:str,output_dir:Optional[str]=None)->Tuple[str,str]:
         """处理本地视频文件"""
         if not os.path.exists(file_path):raise FileNotFoundError(f"File not found: {file_path}")
@@ -128,28 +232,150 @@ class VideoProcessor:
         else:
             return self.process_file(src,output_dir)
 
-def extract_audio_for_asr(video_path:str,output_audio:Optional[str]=None,ffmpeg_path:str="ffmpeg")->str:
-    """便捷函数：从视频中提取适合ASR的音频格式"""
+@lru_cache(maxsize=None)
+def _ffprobe_path(ffmpeg_path:str)->str:
+    """与 ffmpeg 同目录的 ffprobe"""
+    p=Path(resolve_binary(ffmpeg_path))
+    return resolve_binary(str(p.with_name(p.name.replace("ffmpeg","ffprobe"))))
+
+def probe_audio_stream(video_path:str,ffmpeg_path:str="ffmpeg")->Optional[dict]:
+    """读取首个音频流的 codec_name/sample_rate/channels，失败返回 None"""
+    cmd=[_ffprobe_path(ffmpeg_path),"-v","error","-select_streams","a:0",
+         "-show_entries","stream=codec_name,sample_rate,channels","-of","json",video_path]
+    try:
+        r=subprocess.run(cmd,capture_output=True,check=True,text=True)
+        streams=orjson.loads(r.stdout).get("streams") or []
+        return streams[0] if streams else None
+    except (OSError,subprocess.CalledProcessError,ValueError):
+        return None
+
+def _is_asr_ready(stream:Optional[dict])->bool:
+    """音频已是 16kHz 单声道 16-bit PCM，可直接流拷贝"""
+    return bool(stream) and stream.get("codec_name")=="pcm_s16le" \
+        and str(stream.get("sample_rate"))=="16000" and stream.get("channels")==1
+
+def extract_audio_for_asr(video_path:str,output_audio:Optional[str]=None,ffmpeg_path:str="ffmpeg",threads:int=0)->str:
+    """便捷函数：从视频中提取适合ASR的音频格式
+
+    音频已符合 ASR 要求时直接 -c:a copy（纯 IO）；否则转码，threads>0 时限制 ffmpeg 线程数，
+    避免多个任务并行时线程数超额占用 CPU。
+    """
     if not os.path.exists(video_path):
         raise FileNotFoundError(f"视频文件不存在: {video_path}")
 
     if output_audio is None:
         output_audio=f"{Path(video_path).stem}_audio.wav"
 
-    # ASR优化参数：16kHz单声道PCM格式
-    cmd=[
-        ffmpeg_path,"-i",video_path,
-        "-vn","-acodec","pcm_s16le","-ar","16000","-ac","1",
-        "-y",output_audio
-    ]
+    cmd=[resolve_binary(ffmpeg_path),*_QUIET]
+    if threads>0:cmd+=["-threads",str(threads)]
+    cmd+=["-i",video_path,"-vn"]
+    if _is_asr_ready(probe_audio_stream(video_path,ffmpeg_path)):
+        cmd+=["-c:a","copy"]
+    else:
+        # ASR优化参数：16kHz单声道PCM格式
+        cmd+=["-acodec","pcm_s16le","-ar","16000","-ac","1"]
+    cmd+=["-y",output_audio]
 
     try:
-        subprocess.run(cmd,capture_output=True,check=True,text=True)
-        print(f"音频提取完成: {output_audio}")
+        subprocess.run(cmd,stdin=subprocess.DEVNULL,capture_output=True,check=True,text=True)
+        logger.info("音频提取完成: %s",output_audio)
         return output_audio
     except subprocess.CalledProcessError as e:
         raise RuntimeError(f"音频提取失败: {e.stderr}")
 
+def wav_header(n:int,rate:int=16000,channels:int=1,width:int=2)->bytes:
+    """n 字节 PCM 数据对应的 44 字节 RIFF/WAVE 头"""
+    return struct.pack("<4sI4s4sIHHIIHH4sI",b"RIFF",36+n,b"WAVE",b"fmt ",16,1,channels,rate,
+                       rate*channels*width,channels*width,width*8,b"data",n)
+
+class AsrAudio(bytes):
+    """内存中的WAV字节；silences 为提取时顺带检测出的静音区间（未检测时为 None）"""
+    silences:Optional[List[Tuple[float,float]]]=None
+
+def read_audio_for_asr(video_path:str,ffmpeg_path:str="ffmpeg",threads:int=0,detect_silence:bool=False,
+                       noise_db:int=-30,min_duration:float=0.5)->AsrAudio:
+    """提取16kHz单声道PCM，经 stdout 管道读入内存并封装为WAV字节（不写临时文件）
+
+    detect_silence=True 时在同一次解码中串接 silencedetect 滤镜，省去切片前再启动一次 ffmpeg 解码整段音频。
+    """
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"视频文件不存在: {video_path}")
+    # silencedetect 以 info 级别输出结果，检测时不能只保留错误日志
+    cmd=[resolve_binary(ffmpeg_path),"-nostdin","-hide_banner","-nostats"] if detect_silence else [resolve_binary(ffmpeg_path),*_QUIET]
+    if threads>0:cmd+=["-threads",str(threads)]
+    cmd+=["-i",video_path,"-vn"]
+    if detect_silence:cmd+=["-af",f"silencedetect=noise={noise_db}dB:d={min_duration}"]
+    cmd+=["-f","s16le","-acodec","pcm_s16le","-ar","16000","-ac","1","pipe:1"]
+    r=subprocess.run(cmd,stdin=subprocess.DEVNULL,capture_output=True)
+    stderr=r.stderr.decode(errors='replace')
+    if r.returncode!=0:raise RuntimeError(f"音频提取失败: {stderr}")
+    # 管道输出无法回写WAV头中的长度，因此让ffmpeg输出裸PCM，在内存中补上头部；
+    # 长视频的 PCM 可达上百 MB，拼接后立即释放中间对象，内存中最多同时存在两份
+    pcm=r.stdout;r.stdout=None
+    data=wav_header(len(pcm))+pcm;del pcm
+    audio=AsrAudio(data);del data
+    if detect_silence:audio.silences=parse_silences(stderr)
+    return audio
+
+_SHOWINFO_RE=re.compile(r"\bn:\s*\d+\s+pts:\s*-?\d+\s+pts_time:(-?[\d.]+)")
+
+def split_mjpeg(data:bytes)->List[bytes]:
+    """按 SOI(FFD8)/EOI(FFD9) 标记把 MJPEG 字节流切分为单张 JPEG（ffmpeg 的 mjpeg 编码不含内嵌缩略图，熵编码段中的 FF 均已转义）"""
+    frames=[];pos=0
+    while (start:=data.find(b"\xff\xd8",pos))!=-1:
+        end=data.find(b"\xff\xd9",start+2)
+        if end==-1:break
+        frames.append(data[start:end+2]);pos=end+2
+    return frames
+
+def iter_mjpeg(stream,chunk_size:int=1<<16)->Iterator[bytes]:
+    """从二进制流中增量切分 MJPEG（规则同 split_mjpeg），每读到一张完整 JPEG 就立即产出"""
+    buf=bytearray();scan=0
+    while data:=stream.read1(chunk_size):
+        buf+=data
+        while True:
+            start=buf.find(b"\xff\xd8")
+            if start==-1:del buf[:-1];scan=0;break
+            end=buf.find(b"\xff\xd9",max(start+2,scan))
+            # 标记可能跨两次读取，下次从倒数第 1 字节起继续查找
+            if end==-1:scan=len(buf)-1;break
+            yield bytes(buf[start:end+2]);del buf[:end+2];scan=0
+
+def _range_of(t:float,order:List[int],starts:List[float],ranges:list)->int:
+    """时刻 t 所属的时间段下标（起点最近的包含段），不属于任何段时返回 -1"""
+    k=bisect.bisect_right(starts,t)-1
+    # 首尾相接的段共享边界时刻，向前回退到真正包含该时刻的段
+    while k>=0 and t>ranges[order[k]][1]:k-=1
+    return order[k] if k>=0 else -1
+
+def bucket_by_time(items:list,times:List[float],ranges:List[Tuple[float,float]])->List[list]:
+    """按时间戳把 items 分到各时间段（起点最近的包含段），返回与 ranges 对应的列表；不属于任何段的丢弃"""
+    order=sorted(range(len(ranges)),key=lambda i:ranges[i][0])
+    starts=[ranges[i][0] for i in order]
+    out=[[] for _ in ranges]
+    for item,t in zip(items,times):
+        if (k:=_range_of(t,order,starts,ranges))>=0:out[k].append(item)
+    return out
+
+_SILENCE_RE=re.compile(r"silence_(start|end): (-?[\d.]+)")
+
+def parse_silences(stderr:str)->List[Tuple[float,float]]:
+    """解析 silencedetect 输出，返回 [(静音开始秒, 静音结束秒)]"""
+    out,start=[],None
+    for kind,val in _SILENCE_RE.findall(stderr):
+        if kind=="start":start=max(0.0,float(val))
+        elif start is not None:out.append((start,float(val)));start=None
+    return out
+
+def detect_silences(audio:Union[str,bytes],ffmpeg_path:str="ffmpeg",noise_db:int=-30,min_duration:float=0.5)->List[Tuple[float,float]]:
+    """用 ffmpeg silencedetect 找出静音区间，供 ASR 按自然停顿切分；audio 为文件路径或内存中的WAV字节（经 stdin 传入）"""
+    piped=isinstance(audio,bytes)
+    cmd=[resolve_binary(ffmpeg_path),"-hide_banner","-nostats","-i","pipe:0" if piped else audio,
+         "-af",f"silencedetect=noise={noise_db}dB:d={min_duration}","-f","null","-"]
+    if not piped:cmd.insert(1,"-nostdin")
+    r=subprocess.run(cmd,capture_output=True,**({"input":audio} if piped else {"stdin":subprocess.DEVNULL}))
+    return parse_silences(r.stderr.decode(errors="replace")) if r.returncode==0 else []
+
 def split_video(source:Union[str,Path],output_dir:Optional[str]=None,ffmpeg_path:str="ffmpeg")->Tuple[str,str]:
     """便捷函数：分离音视频流"""
     processor=VideoProcessor(ffmpeg_path)
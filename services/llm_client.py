@@ -0,0 +1,15 @@
+"""OpenAI 风格客户端：进程内共享一个实例，环境变量只读取一次，各服务复用同一连接池"""
+import os
+from functools import lru_cache
+from openai import OpenAI
+from dotenv import load_dotenv
+load_dotenv()
+
+
+@lru_cache(maxsize=1)
+def get_openai_client() -> OpenAI:
+    """获取共享客户端（缺少 OPENAI_API_KEY 时抛出 ValueError，且不缓存失败结果）"""
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("请设置环境变量 OPENAI_API_KEY 存储API密钥")
+    return OpenAI(base_url=os.environ.get("OPENAI_BASE_URL"), api_key=api_key)
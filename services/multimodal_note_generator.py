@@ -3,8 +3,8 @@
 图文混排笔记生成器 - 门面类，委托给MultimodalService处理
 """
 import logging
-from typing import Optional
-from services.multimodal_service import MultimodalService
+from typing import Any, Dict, Optional, Tuple
+from services.multimodal_service import MultimodalService, export_to_markdown
 from settings import get_settings
 class MultimodalNoteGenerator:
     def __init__(self, logger: Optional[logging.Logger] = None, task_id: Optional[str] = None):
@@ -19,7 +19,8 @@ class MultimodalNoteGenerator:
                 max_concurrent_segments=s.MULTIMODAL_MAX_CONCURRENT_SEGMENTS,
                 enable_text_alignment=s.MULTIMODAL_ENABLE_TEXT_ALIGNMENT,
                 max_aligned_frames=s.MULTIMODAL_MAX_ALIGNED_FRAMES,
-                logger=self.logger,task_id=task_id
+                logger=self.logger,task_id=task_id,embed_concurrency=s.MULTIMODAL_EMBED_CONCURRENCY,
+                dedup_backend=s.MULTIMODAL_DEDUP_BACKEND,phash_max_distance=s.MULTIMODAL_PHASH_MAX_DISTANCE
             )
             self.multimodal_service.embed_model=s.MULTIMODAL_EMBED_MODEL
             self.multimodal_service.batch_sz=s.MULTIMODAL_BATCH_SIZE
@@ -27,14 +28,26 @@ class MultimodalNoteGenerator:
         except Exception as e:
             self.logger.error(f"MultimodalService 初始化失败: {e}");raise
 
-    def generate_multimodal_notes(self, video_path: str, summary_json_path: str, output_dir: str) -> str:
-        """生成图文混排笔记 - 委托给MultimodalService"""
-        return self.multimodal_service.generate_multimodal_notes(video_path, summary_json_path, output_dir)
+    def generate_multimodal_notes(self, video_path: str, summary_json_path: str, output_dir: str,
+                                  logger: Optional[logging.Logger] = None) -> str:
+        """生成图文混排笔记 - 委托给MultimodalService；logger 为本次任务的日志器"""
+        return self.multimodal_service.generate_multimodal_notes(video_path, summary_json_path, output_dir, logger)
+
+    def generate_multimodal_notes_from_obj(self, video_path: str, summary_obj: Dict[str, Any], output_dir: str,
+                                           logger: Optional[logging.Logger] = None,
+                                           prefetched: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None) -> str:
+        """使用内存中的摘要数据生成图文笔记（无需重新读取 summary.json）"""
+        return self.multimodal_service.generate_multimodal_notes_from_obj(video_path, summary_obj, output_dir, logger, prefetched)
+
+    def prefetch_segment_frames(self, video_path: str, merged_json_path: str, output_dir: str,
+                                logger: Optional[logging.Logger] = None) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """按合并文本的时间段预先抽帧去重 - 委托给MultimodalService"""
+        return self.multimodal_service.prefetch_segment_frames(video_path, merged_json_path, output_dir, logger)
 
     def export_to_markdown(self, notes_json_path: str, output_path: str = None,
                           image_base_path: str = None, for_web: bool = True) -> str:
         """导出Markdown格式 - 委托给MultimodalService"""
-        return self.multimodal_service.export_to_markdown(notes_json_path, output_path, image_base_path, for_web)
+        return export_to_markdown(notes_json_path, output_path, image_base_path, for_web)
 
 
 
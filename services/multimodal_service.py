@@ -1,12 +1,20 @@
 """多模态服务 - 统一的帧提取、嵌入生成和去重服务"""
-import os,base64,time,logging,tempfile,shutil,json,concurrent.futures,threading
+import io,os,uuid,base64,time,logging,tempfile,shutil,concurrent.futures,threading
+from functools import lru_cache
 from typing import List,Optional,Dict,Any,Tuple
 from datetime import datetime
 from pathlib import Path
-import cohere,numpy as np
+import numpy as np,orjson
 from services.ffmpeg_process import VideoProcessor
-from PIL import Image
-import faiss
+from utils.uring_io import get_engine,read_files,write_files
+from utils.io_utils import atomic_write
+from utils.image_hash import hash_frames,hamming_matrix,open_gray
+
+@lru_cache(maxsize=1)
+def _load_faiss():
+    """按需导入 faiss（导入耗时较长，只有去重时才需要）；未安装时返回 None，改用 numpy 实现"""
+    try:import faiss;return faiss
+    except ImportError:return None
 
 
 class MultimodalService:
@@ -14,13 +22,22 @@ class MultimodalService:
     EMBED_MODEL="embed-v4.0"
     BATCH_SIZE=10
     API_DELAY=0.1
+    BATCH_RANGES=32  # 批量抽帧时每次 ffmpeg 调用处理的时间段数（限制 select 表达式长度）
     IMG_FORMATS={'.png':'image/png','.jpg':'image/jpeg','.jpeg':'image/jpeg','.gif':'image/gif','.webp':'image/webp'}
 
     def __init__(self,cohere_api_key:str,ffmpeg_path:str="ffmpeg",similarity_threshold:float=0.9,
                  embedding_model:str=EMBED_MODEL,batch_size:int=BATCH_SIZE,frame_fps:float=0.2,
                  max_concurrent_segments:int=3,enable_text_alignment:bool=True,max_aligned_frames:int=3,
-                 logger:Optional[logging.Logger]=None,task_id:Optional[str]=None):
-        """初始化多模态服务"""
+                 logger:Optional[logging.Logger]=None,task_id:Optional[str]=None,embed_concurrency:int=1,
+                 dedup_backend:str="phash",phash_max_distance:int=6):
+        """初始化多模态服务
+
+        dedup_backend="phash" 时相邻帧去重使用本地感知哈希（汉明距离<=phash_max_distance 视为重复），
+        只有保留下来的帧在图文对齐时才请求 embedding；"embedding" 时按 Cohere 图片向量的余弦相似度去重。
+        """
+        if dedup_backend not in ("phash","embedding"):raise ValueError(f"未知的去重方式: {dedup_backend}")
+        self.dedup_backend=dedup_backend
+        self.phash_max_distance=phash_max_distance
         self.api_key=cohere_api_key
         self.sim_thresh=similarity_threshold
         self.embed_model=embedding_model
@@ -29,20 +46,61 @@ class MultimodalService:
         self.max_workers=max_concurrent_segments
         self.enable_text_alignment=enable_text_alignment
         self.max_aligned_frames=max_aligned_frames
+        import cohere  # 延迟导入：只有启用图文笔记时才需要
         self.client=cohere.ClientV2(api_key=cohere_api_key)
         self.video_proc=VideoProcessor(ffmpeg_path)
-        self.logger=logger or logging.getLogger(__name__)
-        self._lock=threading.Lock()
-        # 每个任务独立的嵌入缓存，避免跨用户污染
+        self._default_logger=logger or logging.getLogger(__name__)
+        # 各时间段并发抽帧，图片 embedding 请求最多 embed_concurrency 个同时在途（限流）
+        self._lock=threading.BoundedSemaphore(max(1,embed_concurrency))
+        # 实例可被多个任务共享：日志器与嵌入缓存按线程隔离，避免跨任务/跨用户污染
+        self._local=threading.local()
         self.task_id=task_id or "default"
-        self._emb_cache:Dict[str,np.ndarray]={}
+
+    @property
+    def logger(self)->logging.Logger:
+        return getattr(self._local,"logger",None) or self._default_logger
+
+    @property
+    def _emb_cache(self)->Dict[str,np.ndarray]:
+        cache=getattr(self._local,"emb_cache",None)
+        if cache is None:cache=self._local.emb_cache={}
+        return cache
+
+    def _run_with_logger(self,logger:Optional[logging.Logger],fn,*a):
+        """在当前线程绑定任务日志器后执行fn"""
+        prev=getattr(self._local,"logger",None)
+        self._local.logger=logger or prev
+        try:return fn(*a)
+        finally:self._local.logger=prev
+
+    def _frame_bytes(self,p:str)->bytes:
+        """帧内容：批量抽帧得到的帧只在内存中（按虚拟路径登记在当前线程的 blobs 中），其余从磁盘读取"""
+        blobs=getattr(self._local,"blobs",None)
+        if blobs and p in blobs:return blobs[p]
+        with open(p,"rb") as f:return f.read()
 
     def _ahash(self,p:str,size:int=8)->int:
-        img=Image.open(p).convert('L').resize((size,size))
+        img=open_gray(self._frame_bytes(p),size)
         arr=np.array(img);m=arr.mean();bits=(arr>m).flatten();h=0
         for b in bits:h=(h<<1)|(1 if b else 0)
         return h
 
+    def remove_duplicates_phash(self,paths:List[str])->List[str]:
+        """基于感知哈希去重：与已保留的任一帧汉明距离不超过阈值即视为重复（纯本地计算）"""
+        # 哈希是纯 CPU 计算，交给进程池并行，不受 GIL 限制
+        valid,hashes=[],[]
+        for p,h in zip(paths,hash_frames([self._frame_bytes(p) for p in paths])):
+            if h is None:self.logger.warning(f"Hash fail {p}");continue
+            valid.append(p);hashes.append(h)
+        kept=[]
+        if hashes:
+            dist=hamming_matrix(hashes)
+            for i in range(len(valid)):
+                if not kept or dist[i,kept].min()>self.phash_max_distance:kept.append(i)
+        kept=[valid[i] for i in kept]
+        self.logger.info(f"Removed {len(paths)-len(kept)} duplicates, kept {len(kept)}")
+        return kept
+
     def _prefilter_by_hash(self,paths:List[str])->List[str]:
         seen=set();out=[]
         for p in paths:
@@ -71,9 +129,8 @@ class MultimodalService:
 
     def _to_base64(self,path:str)->str:
         """转换图片为base64格式"""
-        with open(path,"rb") as f:
-            data=base64.b64encode(f.read()).decode('utf-8')
-            return f"data:{self._get_mime_type(path)};base64,{data}"
+        data=base64.b64encode(self._frame_bytes(path)).decode('utf-8')
+        return f"data:{self._get_mime_type(path)};base64,{data}"
 
     def generate_embeddings(self,paths:List[str],batch_size:Optional[int]=None,lock:Optional[object]=None)->Tuple[List[np.ndarray],List[str]]:
         """批量获取图片embeddings（带缓存）"""
@@ -83,7 +140,7 @@ class MultimodalService:
         paths=self._prefilter_by_hash(paths)
         for i in range(0,len(paths),bs):
             batch=paths[i:i+bs];data,valid,need=[],[],[]
-            self.logger.info(f"Processing batch {i//bs+1}/{(len(paths)+bs-1)//bs}")
+            self.logger.info("Processing batch %d/%d",i//bs+1,(len(paths)+bs-1)//bs)
             for p in batch:
                 if p in self._emb_cache:
                     embeds.append(self._emb_cache[p]);success.append(p);continue
@@ -125,6 +182,7 @@ class MultimodalService:
         if not paths:return []
         # 归一化
         E=np.array([e/np.linalg.norm(e) if np.linalg.norm(e)>0 else e for e in embeds],dtype=np.float32)
+        faiss=_load_faiss()
         if faiss is None:
             keep_idx=[];R=None
             for i,v in enumerate(E):
@@ -148,14 +206,40 @@ class MultimodalService:
         self.logger.info(f"Removed {len(paths)-len(result)} duplicates, kept {len(result)}")
         return result
 
-    def save_unique_frames(self,paths:List[str],output_dir:str,copy_files:bool=True)->List[str]:
-        """保存去重后的图片"""
+    @staticmethod
+    def _link_or_copy(src:str,dst:str):
+        """优先硬链接（零拷贝），跨文件系统等失败时回退到内核态拷贝"""
+        try:
+            Path(dst).unlink(missing_ok=True)
+            os.link(src,dst)
+        except OSError:
+            shutil.copyfile(src,dst)
+
+    def save_unique_frames(self,paths:List[str],output_dir:str,copy_files:bool=True,link:bool=False)->List[str]:
+        """保存去重后的图片
+        copy_files=False 时移动源文件（同一文件系统内仅重命名）；link=True 时硬链接源文件
+        """
         os.makedirs(output_dir,exist_ok=True)
+        engine=get_engine()
+        blobs=getattr(self._local,"blobs",None) or {}
+        if engine and copy_files and not link:
+            try:
+                dsts={src:os.path.join(output_dir,f"unique_frame_{i+1:06d}.jpg") for i,src in enumerate(paths)}
+                data=read_files(engine,[src for src in dsts if src not in blobs])
+                data.update({src:blobs[src] for src in dsts if src in blobs})
+                write_files(engine,{dsts[src]:data[src] for src in paths})
+                self.logger.info(f"Saved {len(dsts)} frames to {output_dir} (io_uring)")
+                return list(dsts.values())
+            except Exception as e:
+                self.logger.warning(f"io_uring 批量写入失败，回退逐个复制: {e}")
         saved=[]
         for i,src in enumerate(paths):
             dst=os.path.join(output_dir,f"unique_frame_{i+1:06d}.jpg")
             try:
-                (shutil.copy2 if copy_files else shutil.move)(src,dst)
+                if src in blobs:
+                    with open(dst,"wb") as f:f.write(blobs[src])
+                elif link:self._link_or_copy(src,dst)
+                else:(shutil.copy2 if copy_files else shutil.move)(src,dst)
                 saved.append(dst)
             except Exception as e:
                 self.logger.warning(f"Failed to save {src}: {e}")
@@ -164,33 +248,49 @@ class MultimodalService:
 
     def process_video_frames(self,video_path:str,start_time:float,end_time:float,output_dir:str,
                            fps:float=1.0,temp_dir:Optional[str]=None,keep_temp:bool=False,
-                           lock:Optional[object]=None)->Dict[str,Any]:
-        """视频帧去重处理流程"""
+                           lock:Optional[object]=None,frames:Optional[List[str]]=None,
+                           blobs:Optional[Dict[str,bytes]]=None)->Dict[str,Any]:
+        """视频帧去重处理流程；frames 为调用方已抽好的临时帧（跳过抽帧，可直接移动，由调用方清理其目录）
+
+        blobs 为 虚拟路径 -> JPEG 字节：frames 只在内存中时传入，去重后只有保留的帧写入磁盘。
+        """
         self.logger.info(f"Processing {video_path} [{start_time}s-{end_time}s] fps={fps} thresh={self.sim_thresh}")
 
-        temp_created=temp_dir is None
-        if temp_created:temp_dir=tempfile.mkdtemp(prefix="video_dedup_")
-        else:os.makedirs(temp_dir,exist_ok=True)
+        given=frames is not None
+        temp_created=temp_dir is None and not given
+        # 临时目录建在输出目录下，保证与输出同一文件系统，保存时可直接重命名而无需拷贝
+        os.makedirs(output_dir,exist_ok=True)
+        if temp_created:temp_dir=tempfile.mkdtemp(prefix=".video_dedup_",dir=output_dir)
+        elif temp_dir:os.makedirs(temp_dir,exist_ok=True)
+        prev_blobs=getattr(self._local,"blobs",None)
+        self._local.blobs=blobs
 
         try:
-            self.logger.info("1. Extracting frames...")
-            frames=self.extract_frames(video_path,start_time,end_time,fps,temp_dir)
-            # 预过滤，减少后续embedding调用
-            frames=self._prefilter_by_hash(frames)
+            if not given:
+                self.logger.info("1. Extracting frames...")
+                frames=self.extract_frames(video_path,start_time,end_time,fps,temp_dir)
+            if self.dedup_backend=="phash":
+                # 本地感知哈希去重，不请求 embedding；保留帧的向量在图文对齐时按需获取
+                self.logger.info("2. Removing duplicates (phash)...")
+                embeds=[];unique=self.remove_duplicates_phash(frames)
+            else:
+                # 预过滤，减少后续embedding调用
+                frames=self._prefilter_by_hash(frames)
 
-            self.logger.info("2. Getting embeddings...")
-            embeds,success=self.generate_embeddings(frames,lock=lock)
-            if len(embeds)!=len(frames):
-                self.logger.warning(f"Got {len(embeds)} embeddings for {len(frames)} frames");frames=success
+                self.logger.info("2. Getting embeddings...")
+                embeds,success=self.generate_embeddings(frames,lock=lock)
+                if len(embeds)!=len(frames):
+                    self.logger.warning(f"Got {len(embeds)} embeddings for {len(frames)} frames");frames=success
 
-            self.logger.info("3. Removing duplicates...")
-            unique=self.remove_duplicates(frames,embeds)
+                self.logger.info("3. Removing duplicates...")
+                unique=self.remove_duplicates(frames,embeds)
 
             self.logger.info("4. Saving unique frames...")
-            saved=self.save_unique_frames(unique,output_dir)
+            # 临时帧随后会被删除，直接移动即可
+            saved=self.save_unique_frames(unique,output_dir,copy_files=not ((temp_created or given) and not keep_temp))
             # 将embedding按保存后的路径对齐，避免路径变更导致无法复用
             ftomap={p:e for p,e in zip(frames,embeds)}
-            embed_map={saved[i]:ftomap.get(unique[i]) for i in range(len(saved))}
+            embed_map={saved[i]:ftomap[unique[i]] for i in range(len(saved)) if unique[i] in ftomap}
 
             result={"video_path":video_path,"time_range":(start_time,end_time),"fps":fps,
                    "total_frames":len(frames),"unique_frames":len(saved),
@@ -200,6 +300,7 @@ class MultimodalService:
             self.logger.info("✅ Process completed!")
             return result
         finally:
+            self._local.blobs=prev_blobs
             if temp_created and not keep_temp:
                 try:
                     shutil.rmtree(temp_dir)
@@ -207,29 +308,61 @@ class MultimodalService:
                 except Exception as e:
                     self.logger.warning(f"Failed cleanup: {e}")
 
-    def _parse_time(self,t:str)->float:
-        """时间字符串转秒数"""
-        try:
-            parts=t.split(':')
-            h,m=int(parts[0]),int(parts[1])
-            s_parts=parts[2].split('.')
-            s=int(s_parts[0])
-            ms=int(s_parts[1]) if len(s_parts)>1 else 0
-            return h*3600+m*60+s+ms/1000
-        except (ValueError,IndexError) as e:
-            raise ValueError(f"时间格式错误: {t}, {e}")
+    @staticmethod
+    def _segment_dir(output_dir:str,start_time:str,end_time:str)->str:
+        return os.path.join(output_dir,f"segment_{start_time.replace(':','-')}_to_{end_time.replace(':','-')}")
 
-    def extract_segment_frames(self,video_path:str,start_time:str,end_time:str,output_dir:str,
-                             text_summary:str="",enable_alignment:bool=True)->List[str]:
-        """提取时间段视频帧并去重，支持图文对齐"""
-        start_sec,end_sec=self._parse_time(start_time),self._parse_time(end_time)
-        seg_dir=os.path.join(output_dir,f"segment_{start_time.replace(':','-')}_to_{end_time.replace(':','-')}")
+    def _dedup_segment_frames(self,video_path:str,start_time:str,end_time:str,output_dir:str)->Dict[str,Any]:
+        """提取时间段视频帧并去重（自适应FPS，目标<=10帧）"""
+        start_sec,end_sec=parse_time(start_time),parse_time(end_time)
+        seg_dir=self._segment_dir(output_dir,start_time,end_time)
         os.makedirs(seg_dir,exist_ok=True)
+        seg_fps=self._choose_fps(end_sec-start_sec,target=10)
+        return self.process_video_frames(video_path,start_sec,end_sec,seg_dir,seg_fps,keep_temp=False,lock=self._lock)
+
+    def _dedup_segments_batch(self,video_path:str,ranges:List[Tuple[str,str]],output_dir:str)->Dict[Tuple[str,str],Dict[str,Any]]:
+        """多个时间段共用 ffmpeg 抽帧（每 BATCH_RANGES 段一次调用），各段帧收齐即并发去重，与后续抽帧重叠
+
+        返回 {(start,end): 去重结果}；抽帧失败的段不在结果中，由调用方逐段重试。
+        """
+        parsed=[]
+        for start,end in ranges:
+            try:s,e=parse_time(start),parse_time(end)
+            except ValueError as ex:self.logger.warning(f"跳过时间段 {start}-{end}: {ex}");continue
+            if e>s:parsed.append((start,end,s,e,self._choose_fps(e-s,target=10)))
+        parsed.sort(key=lambda r:r[2])
+        os.makedirs(output_dir,exist_ok=True)
+        # 帧经管道读入内存，不写临时文件；虚拟路径只作为帧的唯一键（embedding 缓存等），去重后保留的帧才写入 seg_dir
+        prefix=os.path.join(output_dir,f".frames_{uuid.uuid4().hex}")
+        logger=self.logger;results={}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures={}
+            for i in range(0,len(parsed),self.BATCH_RANGES):
+                chunk=parsed[i:i+self.BATCH_RANGES]
+                # 边解码边分发：某段的帧收齐即提交去重，与 ffmpeg 解码后续段重叠；失败时已提交的段不受影响
+                try:
+                    for j,jpegs in self.video_proc.iter_frames_batch(video_path,[(s,e,fps) for _,_,s,e,fps in chunk]):
+                        start,end,s,e,fps=chunk[j]
+                        blobs={os.path.join(prefix,f"{i+j:06d}_{n:04d}.jpg"):data for n,data in enumerate(jpegs)}
+                        seg_dir=self._segment_dir(output_dir,start,end)
+                        futures[executor.submit(self._run_with_logger,logger,self.process_video_frames,
+                                                video_path,s,e,seg_dir,fps,None,False,self._lock,list(blobs),blobs)]=(start,end)
+                except Exception as ex:
+                    self.logger.warning(f"批量抽帧失败（{len(chunk)} 个时间段）: {ex}")
+            for future in concurrent.futures.as_completed(futures):
+                try:results[futures[future]]=future.result()
+                except Exception as ex:self.logger.warning(f"时间段去重失败 {futures[future]}: {ex}")
+        return results
+
+    def extract_segment_frames(self,video_path:str,start_time:str,end_time:str,output_dir:str,
+                             text_summary:str="",enable_alignment:bool=True,
+                             prefetched:Optional[Dict[str,Any]]=None)->List[str]:
+        """提取时间段视频帧并去重，支持图文对齐；prefetched 为该时间段已完成的去重结果"""
+        seg_dir=self._segment_dir(output_dir,start_time,end_time)
 
         try:
-            # 1. 先提取和去重帧（自适应FPS，目标<=10帧）
-            dur=end_sec-start_sec;seg_fps=self._choose_fps(dur,target=10)
-            result=self.process_video_frames(video_path,start_sec,end_sec,seg_dir,seg_fps,keep_temp=False,lock=self._lock)
+            # 1. 先提取和去重帧（已预抽帧时直接复用）
+            result=prefetched or self._dedup_segment_frames(video_path,start_time,end_time,output_dir)
             frame_paths=result.get("saved_paths",[]);embed_map=result.get("embeddings",{})
 
             # 2. 如果启用对齐且有文本摘要，进行图文对齐（复用embedding）
@@ -237,7 +370,7 @@ class MultimodalService:
                 aligned_paths=self.align_frames_with_text(frame_paths,text_summary,embeds=embed_map)
                 # 重新保存对齐后的帧到新目录
                 aligned_dir=os.path.join(seg_dir,"aligned")
-                final_paths=self.save_unique_frames(aligned_paths,aligned_dir,copy_files=True)
+                final_paths=self.save_unique_frames(aligned_paths,aligned_dir,link=True)
                 return final_paths
 
             return frame_paths
@@ -247,19 +380,19 @@ class MultimodalService:
 
     def _process_segment(self,data:tuple)->dict:
         """处理单个时间段"""
-        i,seg,vid_path,frames_dir,out_dir=data
+        i,seg,vid_path,frames_dir,out_dir,prefetched=data
         start,end,summary=seg.get("start_time",""),seg.get("end_time",""),seg.get("summary","")
 
         try:
             # 传入摘要文本进行图文对齐
-            paths=self.extract_segment_frames(vid_path,start,end,frames_dir,summary,enable_alignment=True)
+            paths=self.extract_segment_frames(vid_path,start,end,frames_dir,summary,enable_alignment=True,prefetched=prefetched)
             rel_paths=[os.path.relpath(p,out_dir) for p in paths]
         except Exception as e:
             self.logger.error(f"段 {start}-{end} 失败: {e}")
             rel_paths=[]
 
         return {"segment_id":i+1,"start_time":start,"end_time":end,
-                "duration_seconds":self._parse_time(end)-self._parse_time(start),
+                "duration_seconds":parse_time(end)-parse_time(start),
                 "summary":summary,"key_frames":rel_paths,"frame_count":len(rel_paths)}
 
     def align_frames_with_text(self,frame_paths:List[str],text_summary:str,max_frames:int=None,embeds:Optional[Dict[str,np.ndarray]]=None)->List[str]:
@@ -278,8 +411,9 @@ class MultimodalService:
                 if v is None:missing.append(p)
                 else:img_vecs.append(v);valid_paths.append(p)
             if missing:
-                new_vecs,_=self.generate_embeddings(missing)
-                for p,v in zip(missing,new_vecs):self._emb_cache[p]=v;img_vecs.append(v);valid_paths.append(p)
+                # 预过滤可能剔除部分帧，按实际成功的路径对应向量
+                new_vecs,ok=self.generate_embeddings(missing,lock=self._lock)
+                for p,v in zip(ok,new_vecs):self._emb_cache[p]=v;img_vecs.append(v);valid_paths.append(p)
             if not img_vecs:return frame_paths[:max_frames]
             sims=[self.calc_similarity(t,v) for v in img_vecs]
             idx=sorted(range(len(sims)),key=lambda i:sims[i],reverse=True)
@@ -289,11 +423,36 @@ class MultimodalService:
         except Exception as e:
             self.logger.warning(f"图文对齐失败: {e}, 使用原始帧");return frame_paths[:max_frames]
 
-    def generate_multimodal_notes(self,video_path:str,summary_json_path:str,output_dir:str)->str:
-        """生成图文混排笔记（并发处理）"""
-        with open(summary_json_path,'r',encoding='utf-8') as f:
-            data=json.load(f)
-
+    def generate_multimodal_notes(self,video_path:str,summary_json_path:str,output_dir:str,logger:Optional[logging.Logger]=None)->str:
+        """生成图文混排笔记（并发处理）；logger 为本次任务的日志器"""
+        return self._run_with_logger(logger,self._generate_multimodal_notes,video_path,summary_json_path,output_dir)
+
+    def generate_multimodal_notes_from_obj(self,video_path:str,summary_obj:Dict[str,Any],output_dir:str,logger:Optional[logging.Logger]=None,
+                                           prefetched:Optional[Dict[Tuple[str,str],Dict[str,Any]]]=None)->str:
+        """直接使用内存中的摘要数据生成图文笔记，省去 summary.json 的读取与解析；prefetched 为预抽帧结果"""
+        return self._run_with_logger(logger,self._generate_from_summary,video_path,summary_obj,output_dir,prefetched)
+
+    def _generate_multimodal_notes(self,video_path:str,summary_json_path:str,output_dir:str)->str:
+        with open(summary_json_path,'rb') as f:
+            data=orjson.loads(f.read())
+        return self._generate_from_summary(video_path,data,output_dir)
+
+    def prefetch_segment_frames(self,video_path:str,merged_json_path:str,output_dir:str,logger:Optional[logging.Logger]=None)->Dict[Tuple[str,str],Dict[str,Any]]:
+        """按合并文本的时间段预先抽帧去重（不依赖摘要文本，可与摘要生成并行），返回 {(start,end): 去重结果}"""
+        return self._run_with_logger(logger,self._prefetch_segment_frames,video_path,merged_json_path,output_dir)
+
+    def _prefetch_segment_frames(self,video_path:str,merged_json_path:str,output_dir:str)->Dict[Tuple[str,str],Dict[str,Any]]:
+        with open(merged_json_path,'rb') as f:
+            data=orjson.loads(f.read())
+        segs=data.get("merged_sentences",[]) if isinstance(data,dict) else data
+        ranges=list(dict.fromkeys((s.get("start_time",""),s.get("end_time","")) for s in segs if isinstance(s,dict)))
+        results=self._dedup_segments_batch(video_path,ranges,os.path.join(output_dir,"frames"))
+        self.logger.info(f"预抽帧完成: {len(results)}/{len(ranges)} 个时间段")
+        return results
+
+    def _generate_from_summary(self,video_path:str,data:Dict[str,Any],output_dir:str,
+                               prefetched:Optional[Dict[Tuple[str,str],Dict[str,Any]]]=None)->str:
+        logger=self.logger
         summaries=data.get("summaries",[])
         if not summaries:raise ValueError("摘要数据为空")
 
@@ -301,11 +460,16 @@ class MultimodalService:
         frames_dir=os.path.join(output_dir,"frames")
         os.makedirs(frames_dir,exist_ok=True)
 
-        tasks=[(i,seg,video_path,frames_dir,output_dir) for i,seg in enumerate(summaries)]
+        # 未预抽帧的时间段先批量抽帧去重，批量失败的段在 _process_segment 中逐段重试
+        prefetched=dict(prefetched or {})
+        missing=[k for k in dict.fromkeys((seg.get("start_time",""),seg.get("end_time","")) for seg in summaries) if k not in prefetched]
+        if missing:prefetched.update(self._dedup_segments_batch(video_path,missing,frames_dir))
+        tasks=[(i,seg,video_path,frames_dir,output_dir,prefetched.get((seg.get("start_time",""),seg.get("end_time",""))))
+               for i,seg in enumerate(summaries)]
         notes=[]
 
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            future_to_idx={executor.submit(self._process_segment,task):task[0] for task in tasks}
+            future_to_idx={executor.submit(self._run_with_logger,logger,self._process_segment,task):task[0] for task in tasks}
             results={}
 
             for future in concurrent.futures.as_completed(future_to_idx):
@@ -330,79 +494,81 @@ class MultimodalService:
                            "segments_with_frames":len([n for n in notes if n["frame_count"]>0])}}
 
         out_file=os.path.join(output_dir,"multimodal_notes.json")
-        with open(out_file,'w',encoding='utf-8') as f:
-            json.dump(final,f,ensure_ascii=False,indent=4)
+        with atomic_write(out_file,"wb") as f:
+            f.write(orjson.dumps(final,option=orjson.OPT_INDENT_2))
         return out_file
 
     def export_to_markdown(self,notes_json_path:str,output_path:str=None,image_base_path:str=None,for_web:bool=True)->str:
-        """导出为Markdown格式
-        Args:
-            for_web: True=生成web访问路径(/storage/...)，False=生成相对路径(multimodal_notes/...)
-        """
-        with open(notes_json_path,'r',encoding='utf-8') as f:
-            data=json.load(f)
-
-        if not output_path:output_path=f"{Path(notes_json_path).stem}.md"
-        if not image_base_path:image_base_path=str(Path(notes_json_path).parent)
-
-        content=self._gen_markdown(data,output_path,image_base_path,for_web=for_web)
-        with open(output_path,'w',encoding='utf-8') as f:
-            f.write(content)
-        return output_path
-
-    def _gen_markdown(self,data:Dict[str,Any],output_path:str=None,img_base:str=None,for_web:bool=True)->str:
-        """生成Markdown内容"""
-        info,segs,stats=data.get("video_info",{}),data.get("segments",[]),data.get("statistics",{})
-        lines=[]
-
-        # 标题和基本信息
-        lines.extend([f"# 📹 视频笔记：{info.get('source_video','未知视频')}","",
-                     "## 📊 基本信息","",
-                     f"- **视频文件**: {info.get('source_video','未知')}",
-                     f"- **生成时间**: {info.get('generated_at','未知')}",
-                     f"- **总时间段**: {info.get('total_segments',0)}",
-                     f"- **总关键帧**: {stats.get('total_frames',0)}",
-                     f"- **有效时间段**: {stats.get('segments_with_frames',0)}",""])
-
-        # 目录
-        lines.extend(["## 📑 目录",""])
-        for i,seg in enumerate(segs,1):
-            start,end=seg.get("start_time",""),seg.get("end_time","")
-            lines.append(f"{i}. [{start} - {end}](#section-{i})")
-        lines.extend(["","## 📝 详细内容",""])
-
-        # 详细内容
-        for i,seg in enumerate(segs,1):
-            start,end=seg.get("start_time",""),seg.get("end_time","")
-            dur,summary=seg.get("duration_seconds",0),seg.get("summary","")
-            frames=seg.get("key_frames",[])
-
-            lines.extend([f"### <a id='section-{i}'></a>时间段 {i}","",f"**⏰ 时间**: {start} - {end} ({dur:.1f}秒)","",
-                         "**📋 摘要**:","",summary,""])
-
-            if frames:
-                lines.extend([f"**🖼️ 关键帧** ({len(frames)}张):",""])
-                for fp in frames:
-                    name=Path(fp).name
-                    if for_web:
-                        # Web访问：需要绝对路径，从img_base提取task_id
-                        task_id = Path(img_base).name if img_base else "unknown"
-                        path=f"/storage/tasks/{task_id}/multimodal_notes/{fp}"
-                    else:
-                        # PDF导出：使用相对路径
-                        path=f"multimodal_notes/{fp}"
-                    lines.append(f"![{name}]({path})")
-                lines.append("")
-            else:
-                lines.extend(["*该时间段无关键帧*",""])
-            lines.extend(["---",""])
-
-        # 页脚
-        lines.extend(["## 🔧 生成信息","","本笔记由视频处理 API 自动生成",
-                     f"生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"])
-        if output_path:lines.append(f"输出文件: {output_path}")
-
-        return "\n".join(lines)
+        """导出为Markdown格式（委托给模块级 export_to_markdown）"""
+        return export_to_markdown(notes_json_path,output_path,image_base_path,for_web)
+
+
+@lru_cache(maxsize=4096)
+def parse_time(t:str)->float:
+    """HH:MM:SS[.mmm] 转秒数；同一时间串会在分组、抽帧、时长计算中重复解析，结果缓存"""
+    try:
+        h,m,s=t.split(':')
+        return int(h)*3600+int(m)*60+float(s)
+    except ValueError as e:
+        raise ValueError(f"时间格式错误: {t}, {e}")
+
+
+def export_to_markdown(notes_json_path:str,output_path:str=None,image_base_path:str=None,for_web:bool=True)->str:
+    """导出为Markdown格式（纯本地操作，无需 API key 或服务实例）
+    Args:
+        for_web: True=生成web访问路径(/storage/...)，False=生成相对路径(multimodal_notes/...)
+    """
+    with open(notes_json_path,'rb') as f:
+        data=orjson.loads(f.read())
+
+    if not output_path:output_path=f"{Path(notes_json_path).stem}.md"
+    if not image_base_path:image_base_path=str(Path(notes_json_path).parent)
+
+    content=gen_markdown(data,output_path,image_base_path,for_web=for_web)
+    with atomic_write(output_path) as f:
+        f.write(content)
+    return output_path
+
+
+_MD_HEAD=("# 📹 视频笔记：{title}\n\n## 📊 基本信息\n\n- **视频文件**: {src}\n- **生成时间**: {generated}\n"
+          "- **总时间段**: {total}\n- **总关键帧**: {frames}\n- **有效时间段**: {valid}\n\n## 📑 目录\n\n")
+_MD_TOC="{i}. [{start} - {end}](#section-{i})\n"
+_MD_SEG="### <a id='section-{i}'></a>时间段 {i}\n\n**⏰ 时间**: {start} - {end} ({dur:.1f}秒)\n\n**📋 摘要**:\n\n{summary}\n\n"
+_MD_FOOT="## 🔧 生成信息\n\n本笔记由视频处理 API 自动生成\n生成时间: {now}"
+
+def gen_markdown(data:Dict[str,Any],output_path:str=None,img_base:str=None,for_web:bool=True)->str:
+    """生成Markdown内容（按段套用预置模板写入同一个缓冲区）"""
+    info,segs,stats=data.get("video_info",{}),data.get("segments",[]),data.get("statistics",{})
+    buf=io.StringIO();w=buf.write
+
+    # 标题、基本信息和目录
+    w(_MD_HEAD.format(title=info.get('source_video','未知视频'),src=info.get('source_video','未知'),
+                      generated=info.get('generated_at','未知'),total=info.get('total_segments',0),
+                      frames=stats.get('total_frames',0),valid=stats.get('segments_with_frames',0)))
+    for i,seg in enumerate(segs,1):
+        w(_MD_TOC.format(i=i,start=seg.get("start_time",""),end=seg.get("end_time","")))
+    w("\n## 📝 详细内容\n\n")
+
+    # Web访问：需要绝对路径，从img_base提取task_id；PDF导出：使用相对路径
+    prefix=f"/storage/tasks/{Path(img_base).name if img_base else 'unknown'}/multimodal_notes/" if for_web else "multimodal_notes/"
+
+    # 详细内容
+    for i,seg in enumerate(segs,1):
+        frames=seg.get("key_frames",[])
+        w(_MD_SEG.format(i=i,start=seg.get("start_time",""),end=seg.get("end_time",""),
+                         dur=seg.get("duration_seconds",0),summary=seg.get("summary","")))
+        if frames:
+            w(f"**🖼️ 关键帧** ({len(frames)}张):\n\n")
+            for fp in frames:w(f"![{Path(fp).name}]({prefix}{fp})\n")
+            w("\n")
+        else:
+            w("*该时间段无关键帧*\n\n")
+        w("---\n\n")
+
+    # 页脚
+    w(_MD_FOOT.format(now=datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    if output_path:w(f"\n输出文件: {output_path}")
+    return buf.getvalue()
 
 
 def create_multimodal_service(cohere_api_key:str,enable_text_alignment:bool=True,**kwargs)->MultimodalService:
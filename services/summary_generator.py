@@ -1,33 +1,66 @@
-import json
 import os
+import re
 import sys
+import hashlib
 import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, AsyncGenerator, Optional
+import orjson
 from openai import OpenAI
-from dotenv import load_dotenv
-load_dotenv()
+from utils.io_utils import atomic_write
+from services.llm_client import get_openai_client
+
+# 口头语/填充词：中文语气词、英文 um/uh 等，连同其后紧跟的逗号一并去除
+_FILLER_RE = re.compile(r"(?:[嗯呃]+|\b(?:um+|uh+|erm|you know|I mean)\b)[，,、]?\s*", re.IGNORECASE)
+_REPEAT_PUNCT_RE = re.compile(r"([，,。.！!？?、\s])\1+")
+
+# 分段摘要提示词；修改后 PROMPT_SHA256 随之变化，依赖提示词的缓存结果随之失效
+_SUMMARY_SYSTEM = "你擅长将口播内容转化为内容摘要。"
+_SUMMARY_PROMPT = """
+Please organize the following video content into a summary:
+
+Content Processing Requirements
+	1.	Remove Redundancy: Eliminate spoken fillers (e.g., “um,” “right,” “you know”), repeated statements, and meaningless words
+	2.	Capture Core: Accurately extract 2–3 key points (e.g., conclusions, decisions, important viewpoints, data)
+	3.	Preserve Completeness: Ensure all necessary information is retained, without omitting any substantive content
+
+Output Format Requirements
+	1.	Structure: Use a “Core Point + Details” hierarchical format; provide a single sentence summarizing the main idea of the segment first, then elaborate key points
+	2.	Bullet Points: Number key points (1. 2. 3.), each point no longer than 2 sentences, concise language
+	3.	Style: Use third-person formal writing; avoid subjective expressions (e.g., “I think,” “we feel”); employ precise and objective wording
+	4.	Formatting: Clear paragraphs (summary sentence as a separate paragraph, numbered points in following lines), no extra blank lines or punctuation
+
+Video Content:
+{content}
+"""
+PROMPT_SHA256 = hashlib.sha256(f"{_SUMMARY_SYSTEM}\0{_SUMMARY_PROMPT}".encode("utf-8")).hexdigest()
+
+
+def compress_transcript(text: str) -> str:
+    """规则压缩转录文本：去除填充词并合并重复标点/空白，减少送入 LLM 的 token 数"""
+    text = _FILLER_RE.sub("", text)
+    return _REPEAT_PUNCT_RE.sub(r"\1", text).strip()
+
 
 class Summarizer:
     """会议内容整理工具（按原始时间段）"""
+    prompt_sha256 = PROMPT_SHA256
     
-    def __init__(self, model_id: str, logger: Optional[logging.Logger] = None):
-        """初始化总结器，使用OpenAI客户端"""
+    def __init__(self, model_id: str, logger: Optional[logging.Logger] = None, max_workers: int = 4, cache=None,
+                 compress: bool = False):
+        """初始化总结器，使用OpenAI客户端；max_workers 为并发整理的时间段数，cache 为可选的 LLMCache，
+        compress=True 时先用 compress_transcript 去除填充词再送入 LLM"""
         self.model_id = model_id
+        self.max_workers = max(1, max_workers)
+        self.cache = cache
+        self.compress = compress
         self.logger = logger or logging.getLogger(__name__)
         self.client = self._init_openai_client()
         
     def _init_openai_client(self) -> OpenAI:
-        """初始化OpenAI风格客户端"""
-        api_key = os.environ.get("OPENAI_API_KEY")
-        base_url = os.environ.get("OPENAI_BASE_URL")
-        if not api_key:
-            raise ValueError("请设置环境变量 OPENAI_API_KEY 存储API密钥")
-            
-        return OpenAI(
-            base_url=base_url,
-            api_key=api_key
-        )
+        """获取OpenAI风格客户端（进程内共享）"""
+        return get_openai_client()
 
     def load_timed_texts(self, file_path: str) -> List[Dict[str, Any]]:
         """
@@ -38,72 +71,64 @@ class Summarizer:
             raise FileNotFoundError(f"输入文件不存在: {file_path}")
             
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            # 检查数据是字典还是列表
-            sentence_list = []
-            if isinstance(data, list):
-                # 如果根节点就是列表，直接使用
-                sentence_list = data
-            elif isinstance(data, dict):
-                # 如果是字典，遍历它的值，找到第一个是列表的值
-                for value in data.values():
-                    if isinstance(value, list):
-                        sentence_list = value
-                        break
-            
-            if not sentence_list:
-                self.logger.warning("在JSON文件中未找到有效的句子列表")
-                return []
-
-            # 验证并提取数据
-            valid_data = []
-            for item in sentence_list:
-                # 确保item是字典且包含所需键
-                if isinstance(item, dict) and "start_time" in item and "text" in item:
-                    valid_data.append(item)
-
-            self.logger.info(f"成功加载 {len(valid_data)} 条有效文本数据")
-            return valid_data
+            with open(file_path, 'rb') as f:
+                data = orjson.loads(f.read())
+            return self.parse_timed_texts(data)
             
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             raise ValueError(f"文件格式错误，无法解析JSON: {file_path}")
         except Exception as e:
             raise IOError(f"读取文件时发生错误: {file_path}, 错误: {e}")
 
+    def parse_timed_texts(self, data: Any) -> List[Dict[str, Any]]:
+        """从已解析的数据中提取有效的时间段文本（根节点为列表，或第一个列表值）"""
+        # 检查数据是字典还是列表
+        sentence_list = []
+        if isinstance(data, list):
+            # 如果根节点就是列表，直接使用
+            sentence_list = data
+        elif isinstance(data, dict):
+            # 如果是字典，遍历它的值，找到第一个是列表的值
+            for value in data.values():
+                if isinstance(value, list):
+                    sentence_list = value
+                    break
+
+        if not sentence_list:
+            self.logger.warning("在JSON文件中未找到有效的句子列表")
+            return []
+
+        # 验证并提取数据
+        valid_data = []
+        for item in sentence_list:
+            # 确保item是字典且包含所需键
+            if isinstance(item, dict) and "start_time" in item and "text" in item:
+                valid_data.append(item)
+
+        self.logger.info(f"成功加载 {len(valid_data)} 条有效文本数据")
+        return valid_data
+
     def generate_segment_summary(self, segment: Dict[str, Any]) -> Dict[str, Any]:
         """对单个时间段内容进行整理总结"""
         start_time = segment.get("start_time")
         end_time = segment.get("end_time")
         content = segment.get("text", "")
+        if self.compress and content:
+            content = compress_transcript(content)
+        cached = self.cache.get("summary", self.model_id, self.prompt_sha256, content) if self.cache and content else None
         if not content:
             summary = "该时间段无有效内容"
+        elif cached is not None:
+            summary = cached
         else:
-            prompt = f"""
-Please organize the following video content into a summary:
-
-Content Processing Requirements
-	1.	Remove Redundancy: Eliminate spoken fillers (e.g., “um,” “right,” “you know”), repeated statements, and meaningless words
-	2.	Capture Core: Accurately extract 2–3 key points (e.g., conclusions, decisions, important viewpoints, data)
-	3.	Preserve Completeness: Ensure all necessary information is retained, without omitting any substantive content
-
-Output Format Requirements
-	1.	Structure: Use a “Core Point + Details” hierarchical format; provide a single sentence summarizing the main idea of the segment first, then elaborate key points
-	2.	Bullet Points: Number key points (1. 2. 3.), each point no longer than 2 sentences, concise language
-	3.	Style: Use third-person formal writing; avoid subjective expressions (e.g., “I think,” “we feel”); employ precise and objective wording
-	4.	Formatting: Clear paragraphs (summary sentence as a separate paragraph, numbered points in following lines), no extra blank lines or punctuation
-
-Video Content:
-{content}
-"""
+            prompt = _SUMMARY_PROMPT.format(content=content)
             try:
                 completion = self.client.chat.completions.create(
                     model=self.model_id,
                     messages=[
                         {
                             "role": "system",
-                            "content": "你擅长将口播内容转化为内容摘要。"
+                            "content": _SUMMARY_SYSTEM
                         },
                         {
                             "role": "user",
@@ -114,6 +139,8 @@ Video Content:
                     stream=False
                 )
                 summary = completion.choices[0].message.content.strip()
+                if self.cache:
+                    self.cache.set("summary", self.model_id, self.prompt_sha256, content, summary)
             except Exception as e:
                 summary = f"生成总结失败: {str(e)}"
         return {
@@ -122,32 +149,40 @@ Video Content:
             "summary": summary
         }
 
-    def process_file(self, input_path: str, output_path: str) -> bool:
-        """加载→逐条整理→保存，返回成功状态"""
+    def process_file(self, input_path: str, output_path: str, data: Any = None) -> Optional[Dict[str, Any]]:
+        """加载→逐条整理→保存，返回写入的摘要数据（失败返回 None），供下游直接使用
+
+        data 为上一阶段已在内存中的合并结果时直接使用，不再读取并解析 input_path。
+        """
         try:
-            timed_texts = self.load_timed_texts(input_path)
+            timed_texts = self.parse_timed_texts(data) if data is not None else self.load_timed_texts(input_path)
             if not timed_texts:
                 self.logger.error("没有有效文本数据可处理")
-                return False
+                return None
 
-            self.logger.info(f"共 {len(timed_texts)} 个时间段，开始逐条整理...")
-            summaries = []
-            for idx, segment in enumerate(timed_texts):
-                self.logger.info(f"正在处理第 {idx+1}/{len(timed_texts)} 条（{segment.get('start_time')} ~ {segment.get('end_time')}）")
-                summary_item = self.generate_segment_summary(segment)
-                summaries.append(summary_item)
+            total = len(timed_texts)
+            self.logger.info(f"共 {total} 个时间段，开始并发整理（workers={self.max_workers}）...")
 
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump({"summaries": summaries}, f, ensure_ascii=False, indent=4)
+            def summarize(idx: int, segment: Dict[str, Any]) -> Dict[str, Any]:
+                self.logger.info("正在处理第 %d/%d 条（%s ~ %s）", idx + 1, total, segment.get('start_time'), segment.get('end_time'))
+                return self.generate_segment_summary(segment)
+
+            # 各时间段相互独立，并发请求LLM；map 保持原始顺序
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, total)) as executor:
+                summaries = list(executor.map(summarize, range(total), timed_texts))
+
+            result = {"summaries": summaries}
+            with atomic_write(output_path, "wb") as f:
+                f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
 
             self.logger.info(f"处理完成，总结已保存至 {output_path}")
-            return True
+            return result
 
         except Exception as e:
             self.logger.error(f"处理失败: {str(e)}")
-            return False
+            return None
 
-    async def process_file_async(self, input_path: str, output_path: str) -> bool:
+    async def process_file_async(self, input_path: str, output_path: str) -> Optional[Dict[str, Any]]:
         """异步处理文件"""
         try:
             # 在线程池中执行同步方法
@@ -165,8 +200,8 @@ Video Content:
     def load_asr_content(self, asr_file_path: str) -> str:
         """加载ASR结果并拼接成完整文本"""
         try:
-            with open(asr_file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            with open(asr_file_path, 'rb') as f:
+                data = orjson.loads(f.read())
 
             # 处理不同的ASR结果格式
             sentences = []
@@ -267,12 +302,12 @@ Video Content:
         # 如果指定了输出路径，保存到文件
         if output_path:
             try:
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    json.dump({
+                with atomic_write(output_path, "wb") as f:
+                    f.write(orjson.dumps({
                         "full_summary": full_summary,
                         "generated_at": asyncio.get_event_loop().time(),
                         "source_file": asr_file_path
-                    }, f, ensure_ascii=False, indent=2)
+                    }, option=orjson.OPT_INDENT_2))
                 self.logger.info(f"全文摘要已保存到: {output_path}")
             except Exception as e:
                 self.logger.error(f"保存摘要文件失败: {e}")
@@ -1,12 +1,25 @@
 """任务管理服务"""
-import json
+import os
 import uuid
+import shutil
+import asyncio
+import time
+import logging
+import threading
+import weakref
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import orjson
 from fastapi import HTTPException
 
 from utils.task_logger import TaskLogger, create_task_logger
 
+logger = logging.getLogger(__name__)
+
 
 class TaskManager:
     """基于文件系统的简单任务管理"""
@@ -16,6 +29,28 @@ class TaskManager:
         self.storage_dir.mkdir(exist_ok=True)
         self.tasks_dir = self.storage_dir / "tasks"
         self.tasks_dir.mkdir(exist_ok=True)
+        # 元数据缓存: task_id -> ((mtime_ns, size), metadata)；文件未变化时跳过读盘和JSON解析
+        # 按最近访问顺序淘汰，长期运行的服务不会无限增长（磁盘上的文件才是权威数据）
+        self._cache: "OrderedDict[str, Tuple[Tuple[int, int], dict]]" = OrderedDict()
+        self._cache_max = 1024
+        self._cache_lock = threading.Lock()
+        # 进度更新只写入内存，由后台任务每 _flush_interval 秒批量落盘；状态变化时立即写盘
+        self._dirty: Dict[str, dict] = {}
+        self._flush_interval = 0.2
+        self._lock = threading.Lock()
+        # 串行化元数据写盘（保证后写的快照不会被先取的暂存快照覆盖）；写盘期间不持有 _lock，订阅等操作不被磁盘 I/O 阻塞
+        # 加锁顺序固定为 _write_lock -> _lock
+        self._write_lock = threading.Lock()
+        # 步骤内进度节流: task_id -> (上次更新时间, 步骤, 进度)
+        self._last_progress: Dict[str, Tuple[float, str, float]] = {}
+        # 每个任务一把锁，保护 读取-修改-写回，避免并发更新互相覆盖
+        # 弱引用保存：没有线程持有或等待时自动回收，长期运行的服务不会为每个历史任务保留一把锁
+        self._task_locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+        self._task_locks_guard = threading.Lock()
+        # 状态推送订阅: task_id -> [(事件循环, 事件)]；元数据变化时在各自的事件循环中置位事件
+        self._watchers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+        # 最近一次格式化的时间戳: (整秒, ISO字符串)
+        self._ts_cache: Tuple[int, str] = (0, "")
 
     def create_task(self, original_filename: str) -> str:
         """创建新任务"""
@@ -42,46 +77,200 @@ class TaskManager:
 
         return task_id
 
+    def _now_iso(self) -> str:
+        """当前时间（精确到秒）的 ISO 字符串；进度更新频繁，同一秒内复用上次的格式化结果"""
+        sec = int(time.time())
+        cached = self._ts_cache
+        if cached[0] != sec:
+            cached = self._ts_cache = (sec, datetime.fromtimestamp(sec).isoformat())
+        return cached[1]
+
     def get_task_dir(self, task_id: str) -> Path:
         """获取任务目录"""
         return self.tasks_dir / task_id
 
+    def _task_lock(self, task_id: str) -> threading.Lock:
+        # 调用方在 with 语句期间持有返回的锁对象，同一任务的并发调用方因此总是拿到同一把锁
+        with self._task_locks_guard:
+            lock = self._task_locks.get(task_id)
+            if lock is None:
+                lock = self._task_locks[task_id] = threading.Lock()
+            return lock
+
+    def delete_task(self, task_id: str):
+        """删除任务目录及其缓存（用于清理创建后失败的任务）"""
+        TaskLogger.close_logger(task_id)
+        with self._lock:
+            self._dirty.pop(task_id, None)
+        self._cache_pop(task_id)
+        self._last_progress.pop(task_id, None)
+        shutil.rmtree(self.get_task_dir(task_id), ignore_errors=True)
+
+    def _cache_put(self, task_id: str, version: Tuple[int, int], metadata: dict):
+        with self._cache_lock:
+            self._cache[task_id] = (version, metadata)
+            self._cache.move_to_end(task_id)
+            while len(self._cache) > self._cache_max:
+                self._cache.popitem(last=False)
+
+    def _cache_get(self, task_id: str):
+        with self._cache_lock:
+            entry = self._cache.get(task_id)
+            if entry is not None:
+                self._cache.move_to_end(task_id)
+            return entry
+
+    def _cache_pop(self, task_id: str):
+        with self._cache_lock:
+            self._cache.pop(task_id, None)
+
+    @staticmethod
+    def _file_version(st) -> Tuple[int, int]:
+        return st.st_mtime_ns, st.st_size
+
     def save_metadata(self, task_id: str, metadata: dict):
-        """保存任务元数据"""
-        task_dir = self.get_task_dir(task_id)
-        with open(task_dir / "metadata.json", "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        """保存任务元数据（立即写盘，覆盖尚未落盘的进度）"""
+        with self._write_lock:
+            with self._lock:
+                self._dirty.pop(task_id, None)
+            self._write_metadata(task_id, metadata)
+            with self._lock:
+                self._notify(task_id)
+
+    def _write_metadata(self, task_id: str, metadata: dict):
+        # 先写临时文件再原子替换，写入中途崩溃不会留下半截的 metadata.json
+        metadata_file = self.get_task_dir(task_id) / "metadata.json"
+        # 临时文件名唯一，多个 worker 进程同时写同一任务时也不会互相覆盖临时文件
+        tmp_file = metadata_file.with_name(f".metadata.{uuid.uuid4().hex}.tmp")
+        try:
+            tmp_file.write_bytes(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+            os.replace(tmp_file, metadata_file)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+        self._cache_put(task_id, self._file_version(metadata_file.stat()), dict(metadata))
+
+    def _stage_metadata(self, task_id: str, metadata: dict):
+        """暂存元数据，等待后台批量落盘"""
+        with self._lock:
+            self._dirty[task_id] = dict(metadata)
+            self._notify(task_id)
+
+    def subscribe(self, task_id: str) -> asyncio.Event:
+        """订阅任务元数据变化（需在事件循环中调用），返回的事件在元数据变化时被置位"""
+        event = asyncio.Event()
+        with self._lock:
+            self._watchers.setdefault(task_id, []).append((asyncio.get_running_loop(), event))
+        return event
+
+    def unsubscribe(self, task_id: str, event: asyncio.Event):
+        """取消订阅"""
+        with self._lock:
+            watchers = [w for w in self._watchers.get(task_id, ()) if w[1] is not event]
+            if watchers:
+                self._watchers[task_id] = watchers
+            else:
+                self._watchers.pop(task_id, None)
+
+    def _notify(self, task_id: str):
+        # 调用方已持有 self._lock；更新来自后台线程，需通过 call_soon_threadsafe 置位事件
+        for loop, event in self._watchers.get(task_id, ()):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    def flush(self):
+        """将暂存的元数据写盘"""
+        with self._write_lock:
+            with self._lock:
+                pending = list(self._dirty.items())
+            for task_id, metadata in pending:
+                # 写盘完成前条目保留在 _dirty 中：load_metadata 不持锁，提前清空会让读者读到旧文件
+                try:
+                    self._write_metadata(task_id, metadata)
+                except FileNotFoundError:
+                    pass  # 任务目录已被删除
+                except OSError as e:
+                    logger.warning(f"任务 {task_id} 元数据落盘失败，稍后重试: {e}")
+                    continue  # 磁盘满、权限等问题可能恢复，保留暂存内容
+                except Exception as e:
+                    logger.error(f"任务 {task_id} 元数据无法序列化，丢弃本次暂存: {e}")
+                with self._lock:
+                    if self._dirty.get(task_id) is metadata:
+                        del self._dirty[task_id]
+
+    async def run_flush_loop(self):
+        """后台定期落盘（应用启动时创建，关闭时取消）"""
+        try:
+            while True:
+                await asyncio.sleep(self._flush_interval)
+                if self._dirty:
+                    try:
+                        await asyncio.to_thread(self.flush)
+                    except Exception as e:  # 单次落盘失败不能终止后台循环
+                        logger.error(f"元数据批量落盘失败: {e}")
+        finally:
+            self.flush()
 
     def load_metadata(self, task_id: str) -> dict:
-        """加载任务元数据"""
-        task_dir = self.get_task_dir(task_id)
-        metadata_file = task_dir / "metadata.json"
-        if not metadata_file.exists():
+        """加载任务元数据（优先返回未落盘的进度，文件 mtime 未变化时直接返回缓存副本）"""
+        pending = self._dirty.get(task_id)
+        if pending is not None:
+            return dict(pending)
+
+        metadata_file = self.get_task_dir(task_id) / "metadata.json"
+        try:
+            version = self._file_version(metadata_file.stat())
+        except FileNotFoundError:
+            self._cache_pop(task_id)
             raise HTTPException(status_code=404, detail=f"任务不存在: {task_id}")
 
-        with open(metadata_file, "r", encoding="utf-8") as f:
-            return json.load(f)
+        cached = self._cache_get(task_id)
+        if cached is not None and cached[0] == version:
+            return dict(cached[1])
+
+        metadata = orjson.loads(metadata_file.read_bytes())
+        self._cache_put(task_id, version, metadata)
+        return dict(metadata)
+
+    async def aload_metadata(self, task_id: str) -> dict:
+        """异步加载任务元数据：命中未落盘的进度时直接返回，否则在线程池中读取，冷读不阻塞事件循环"""
+        pending = self._dirty.get(task_id)
+        if pending is not None:
+            return dict(pending)
+        return await asyncio.to_thread(self.load_metadata, task_id)
+
+    def update_metadata(self, task_id: str, **fields):
+        """在任务锁内合并字段并写盘"""
+        with self._task_lock(task_id):
+            metadata = self.load_metadata(task_id)
+            metadata.update(fields)
+            self.save_metadata(task_id, metadata)
 
     def update_status(self, task_id: str, status: str, error_message: str = None):
         """更新任务状态"""
-        metadata = self.load_metadata(task_id)
-        metadata["status"] = status
-        # 状态与步骤的关系（完成/失败时更新步骤）
-        if status == "completed":
-            metadata["current_step"] = "completed"
-            metadata["progress_percent"] = 1.0
-        elif status == "failed":
-            metadata["current_step"] = "failed"
-        metadata["updated_at"] = datetime.now().isoformat()
-
-        if error_message is not None:
-            metadata["error_message"] = error_message
+        with self._task_lock(task_id):
+            metadata = self.load_metadata(task_id)
+            metadata["status"] = status
+            # 状态与步骤的关系（完成/失败时更新步骤）
+            if status == "completed":
+                metadata["current_step"] = "completed"
+                metadata["progress_percent"] = 1.0
+            elif status == "failed":
+                metadata["current_step"] = "failed"
+            if status in ("completed", "failed"):
+                self._last_progress.pop(task_id, None)
+            metadata["updated_at"] = self._now_iso()
 
-        self.save_metadata(task_id, metadata)
+            if error_message is not None:
+                metadata["error_message"] = error_message
+
+            self.save_metadata(task_id, metadata)
 
         # 记录状态更新到任务日志
-        if task_id in TaskLogger._loggers:
-            task_logger = TaskLogger._loggers[task_id]
+        task_logger = TaskLogger._loggers.get(task_id)
+        if task_logger is not None:
             if error_message:
                 task_logger.error(f"任务状态更新: {status} - {error_message}")
             else:
@@ -101,31 +290,60 @@ class TaskManager:
 
     def update_step(self, task_id: str, step: str):
         """更新当前步骤到边界并写入累计进度"""
-        md = self.load_metadata(task_id)
-        md["current_step"] = step
-        md["progress_percent"] = self._cumulative_weight(step)
-        md["updated_at"] = datetime.now().isoformat()
-        self.save_metadata(task_id, md)
+        with self._task_lock(task_id):
+            md = self.load_metadata(task_id)
+            md["current_step"] = step
+            md["progress_percent"] = self._cumulative_weight(step)
+            md["updated_at"] = self._now_iso()
+            self._stage_metadata(task_id, md)
+
+    # 同一步骤内，距上次更新不足该间隔且进度变化小于该幅度时跳过
+    _PROGRESS_MIN_INTERVAL = 0.25
+    _PROGRESS_MIN_DELTA = 0.01
 
     def update_progress(self, task_id: str, step: str, fraction: float | None = None):
         """更新当前步骤与进度；fraction为当前步骤内的比例(0-1)"""
-        md = self.load_metadata(task_id)
-        md["current_step"] = step
         if fraction is None:
-            md["progress_percent"] = self._cumulative_weight(step)
+            progress = self._cumulative_weight(step)
         else:
             prev = 0.0
             for s in self._STEP_ORDER:
                 if s == step:
                     break
                 prev += self._STEP_WEIGHTS.get(s,0.0)
-            md["progress_percent"] = max(0.0, min(1.0, prev + self._STEP_WEIGHTS.get(step,0.0)*max(0.0,min(1.0,fraction))))
-        md["updated_at"] = datetime.now().isoformat()
-        self.save_metadata(task_id, md)
+            progress = max(0.0, min(1.0, prev + self._STEP_WEIGHTS.get(step,0.0)*max(0.0,min(1.0,fraction))))
 
-    def validate_task_completed(self, task_id: str) -> dict:
-        """验证任务是否完成并返回元数据"""
-        metadata = self.load_metadata(task_id)
+        now = time.monotonic()
+        last = self._last_progress.get(task_id)
+        if (last is not None and last[1] == step
+                and now - last[0] < self._PROGRESS_MIN_INTERVAL
+                and abs(progress - last[2]) < self._PROGRESS_MIN_DELTA):
+            return
+        self._last_progress[task_id] = (now, step, progress)
+
+        with self._task_lock(task_id):
+            md = self.load_metadata(task_id)
+            md["current_step"] = step
+            md["progress_percent"] = progress
+            md["updated_at"] = self._now_iso()
+            self._stage_metadata(task_id, md)
+
+    @staticmethod
+    def _ensure_completed(metadata: dict) -> dict:
         if metadata["status"] != "completed":
             raise HTTPException(status_code=400, detail="任务尚未完成")
         return metadata
+
+    def validate_task_completed(self, task_id: str) -> dict:
+        """验证任务是否完成并返回元数据"""
+        return self._ensure_completed(self.load_metadata(task_id))
+
+    async def avalidate_task_completed(self, task_id: str) -> dict:
+        """validate_task_completed 的异步版本，供路由使用"""
+        return self._ensure_completed(await self.aload_metadata(task_id))
+
+
+@lru_cache(maxsize=1)
+def get_task_manager() -> TaskManager:
+    """进程内共享的任务管理器（暂存的进度需对所有路由可见）"""
+    return TaskManager()
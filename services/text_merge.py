@@ -1,56 +1,68 @@
-import json,re,os,datetime,asyncio
-from openai import OpenAI
-from dotenv import load_dotenv
-load_dotenv()
+import re,asyncio,hashlib,logging
+from typing import Optional
+import orjson
+from utils.io_utils import atomic_write
+from services.llm_client import get_openai_client
+logger=logging.getLogger(__name__)
+
+# 文本分组提示词；修改后 PROMPT_SHA256 随之变化，依赖提示词的缓存结果随之失效
+_MERGE_PROMPT="""
+Translate the input subtitle sentences into several phases based on semantic relevance. Each phase shall have consistent themes and closely connected contexts, with the following requirements:
+Maintain the original order without disruption.
+Do not merge all sentences into a single whole; the number of phases shall be 2 or more.
+If two sentences have significantly different themes, they shall be grouped into different phases.
+Output a JSON array, where each element contains:
+"text": The merged complete text (sentences connected by spaces)
+"original_indices": A list of original sentence indices involved in the merge (in the original order)
+Input:
+{input_text}
+"""
+PROMPT_SHA256=hashlib.sha256(_MERGE_PROMPT.encode("utf-8")).hexdigest()
 
 class TextMerger:
     """文本合并器：将语音识别的短句合并为完整段落"""
-    def __init__(self,model_id:str):
-        self.client=OpenAI(base_url=os.environ.get("OPENAI_BASE_URL"),api_key=os.environ.get("OPENAI_API_KEY"))
-        self.model_id=model_id
-        if not os.environ.get("OPENAI_API_KEY"):raise ValueError("需要OPENAI_API_KEY环境变量")
+    prompt_sha256=PROMPT_SHA256
+    def __init__(self,model_id:str,cache=None):
+        """cache 为可选的 LLMCache，命中时复用相同输入的分组结果"""
         if not model_id:raise ValueError("需要model_id")
+        self.client=get_openai_client()
+        self.model_id=model_id
+        self.cache=cache
 
     def load_json(self,fp:str)->list:
         try:
-            with open(fp,'r',encoding='utf-8') as f:
-                d=json.load(f)
+            with open(fp,'rb') as f:
+                d=orjson.loads(f.read())
                 return d.get("result_sentences",[]) if isinstance(d,dict) else d if isinstance(d,list) else []
-        except:return []
+        except (OSError,orjson.JSONDecodeError):return []
 
     def save_json(self,data:list,fp:str):
-        with open(fp,'w',encoding='utf-8') as f:json.dump({"merged_sentences":data},f,ensure_ascii=False,indent=4)
+        with atomic_write(fp,"wb") as f:f.write(orjson.dumps({"merged_sentences":data},option=orjson.OPT_INDENT_2))
 
     def _format_time(self,ms:int)->str:
+        """毫秒 -> HH:MM:SS.mmm（纯整数运算，不构造 timedelta）"""
         if not isinstance(ms,int):return str(ms)
-        td=datetime.timedelta(milliseconds=ms)
-        h,r=divmod(td.seconds,3600)
-        m,s=divmod(r,60)
-        return f"{h:02d}:{m:02d}:{s:02d}.{td.microseconds//1000:03d}"
+        s,ms=divmod(ms,1000)
+        m,s=divmod(s,60)
+        h,m=divmod(m,60)
+        return f"{h:02d}:{m:02d}:{s:02d}.{ms:03d}"
 
     def _merge_texts(self,sentences:list)->list:
         if not sentences:return []
 
         input_text="\n".join([f"[{i}]: {s['text']}" for i,s in enumerate(sentences)])
-        prompt = f"""
-Translate the input subtitle sentences into several phases based on semantic relevance. Each phase shall have consistent themes and closely connected contexts, with the following requirements:
-Maintain the original order without disruption.
-Do not merge all sentences into a single whole; the number of phases shall be 2 or more.
-If two sentences have significantly different themes, they shall be grouped into different phases.
-Output a JSON array, where each element contains:
-"text": The merged complete text (sentences connected by spaces)
-"original_indices": A list of original sentence indices involved in the merge (in the original order)
-Input:
-{input_text}
-"""
+        prompt=_MERGE_PROMPT.format(input_text=input_text)
 
+        cached=self.cache.get("merge",self.model_id,self.prompt_sha256,input_text) if self.cache else None
         try:
-            resp=self.client.chat.completions.create(model=self.model_id,messages=[{"role":"user","content":prompt}])
-            content=resp.choices[0].message.content
+            groups=cached
+            if groups is None:
+                resp=self.client.chat.completions.create(model=self.model_id,messages=[{"role":"user","content":prompt}])
+                content=resp.choices[0].message.content
 
-            json_match=re.search(r'```json\n(.*?)```',content,re.DOTALL)
-            json_str=json_match.group(1) if json_match else content
-            groups=json.loads(json_str)
+                json_match=re.search(r'```json\n(.*?)```',content,re.DOTALL)
+                json_str=json_match.group(1) if json_match else content
+                groups=orjson.loads(json_str)
 
             results=[]
             for g in groups:
@@ -61,25 +73,28 @@ Input:
                         "start_time":self._format_time(sentences[idx[0]]['start_time']),
                         "end_time":self._format_time(sentences[idx[-1]]['end_time'])
                     })
+            # 分组结果有效才写入缓存，LLM 出错时的回退结果不缓存
+            if cached is None and self.cache:self.cache.set("merge",self.model_id,self.prompt_sha256,input_text,groups)
             return results
         except Exception as e:
-            print(f"LLM错误: {e}")
+            logger.warning("LLM错误，使用未合并的原句: %s",e)
             for s in sentences:
                 s['start_time']=self._format_time(s['start_time'])
                 s['end_time']=self._format_time(s['end_time'])
             return sentences
 
 
-    def process_file(self,input_file:str,output_file:str)->bool:
+    def process_file(self,input_file:str,output_file:str)->Optional[dict]:
+        """加载→合并→保存，返回写入的数据（失败返回 None），供下游直接使用"""
         sentences=self.load_json(input_file)
-        if not sentences:return False
+        if not sentences:return None
         merged=self._merge_texts(sentences)
         if merged:
             self.save_json(merged,output_file)
-            return True
-        return False
+            return {"merged_sentences":merged}
+        return None
 
-    async def process_file_async(self, input_file: str, output_file: str) -> bool:
+    async def process_file_async(self, input_file: str, output_file: str) -> Optional[dict]:
         """异步处理文件"""
         try:
             # 在线程池中执行同步方法
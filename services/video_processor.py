@@ -1,21 +1,53 @@
 """视频处理工作流服务"""
 import os
+import hashlib
 import logging
-from typing import Dict
+import orjson
+import threading
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, NamedTuple, Optional, Tuple
 
 from services.text_merge import TextMerger
 from services.summary_generator import Summarizer
 from .asr_tencent.asr_service import ASRService
-from services.ffmpeg_process import extract_audio_for_asr
-from services.multimodal_note_generator import MultimodalNoteGenerator
+from services.ffmpeg_process import extract_audio_for_asr, read_audio_for_asr
 from utils.step_decorators import run_step
+from utils.file_utils import create_multimodal_generator, precompress_files
+from utils.llm_cache import get_llm_cache
+from utils.io_utils import atomic_write, sha256_file, sha256_pcm
 from settings import get_settings
 
+# 流水线阶段（顺序与 TaskManager 的进度步骤一致）及各阶段输出文件名
+STAGES = ("extract_audio", "asr", "merge_text", "summary", "multimodal")
+_STAGE_OUTPUTS = {"extract_audio": "audio.wav", "asr": "asr_result.json",
+                  "merge_text": "merged_text.json", "summary": "summary.json"}
+
+
+class _StartPlan(NamedTuple):
+    """从某一阶段开始时的执行计划"""
+    stages: FrozenSet[str]      # 需要执行的阶段
+    skipped: Tuple[str, ...]    # 跳过的阶段
+    required: Optional[str]     # 必须已存在的上一阶段输出文件名
+
+
+# 每个起始阶段的执行计划在导入时一次性生成，process_video 中只做查表
+_START_PLANS: Dict[str, _StartPlan] = {
+    name: _StartPlan(frozenset(STAGES[i:]), STAGES[:i], _STAGE_OUTPUTS[STAGES[i - 1]] if i else None)
+    for i, name in enumerate(STAGES)
+}
+# 阶段输出格式或处理逻辑变化时递增，使旧的 .meta.json 失效
+PIPELINE_VERSION = 1
+
+
 class VideoProcessingWorkflow:
     """视频处理工作流程"""
 
-    def __init__(self, enable_multimodal: bool = True, task_logger: logging.Logger = None, task_manager=None, task_id: str | None = None):
+    def __init__(self, enable_multimodal: bool = True, task_logger: logging.Logger = None, task_manager=None, task_id: str | None = None,
+                 model_id: str | None = None):
         self.enable_multimodal = enable_multimodal
+        self.model_id = model_id or get_settings().MODEL_ID
         self.logger = task_logger or logging.getLogger(__name__)
         self.task_manager = task_manager
         self.task_id = task_id
@@ -24,85 +56,138 @@ class VideoProcessingWorkflow:
     def _init_services(self):
         """初始化所有服务"""
         settings = get_settings()
-        model_id = settings.MODEL_ID
+        model_id = self.model_id
 
         # 核心服务
-        self.text_merger = TextMerger(model_id)
-        self.summary_generator = Summarizer(model_id)
-        self.asr_service = self._create_asr_service()
+        llm_cache = get_llm_cache()
+        self.text_merger = TextMerger(model_id, cache=llm_cache)
+        self.summary_generator = Summarizer(model_id, max_workers=settings.SUMMARY_MAX_CONCURRENCY, cache=llm_cache,
+                                            compress=settings.COMPRESS_TRANSCRIPT)
+        self.asr_service = get_asr_service()
 
         # 可选服务
         self.multimodal_generator = self._create_multimodal_generator() if self.enable_multimodal else None
-        if self.multimodal_generator and self.task_id:
-            # 将task_id传递，隔离缓存
-            try:self.multimodal_generator.__init__(task_id=self.task_id,logger=self.logger)
-            except Exception as e:self.logger.warning(f"无法为多模态服务设置task_id: {e}")
-
-    def _create_asr_service(self):
-        """创建ASR服务"""
-        try:
-            s = get_settings()
-            return ASRService(s.TENCENT_APPID, s.TENCENT_SECRET_ID, s.TENCENT_SECRET_KEY)
-        except ValueError as e:
-            raise RuntimeError(f"ASR服务初始化失败: {e}")
 
     def _create_multimodal_generator(self):
-        """创建图文笔记生成器（从集中配置读取，无需传参）"""
+        """获取图文笔记生成器（与导出接口共享同一实例；任务日志器在每次调用时传入）"""
         try:
-            return MultimodalNoteGenerator(logger=self.logger,task_id=self.task_id)
+            return create_multimodal_generator()
         except Exception as e:
             self.logger.warning(f"跳过图文笔记生成: {e}");return None
 
-    def process_video(self, video_path: str, output_dir: str, keep_temp: bool = False) -> Dict[str, str]:
-        """处理视频的完整流程"""
+    def process_video(self, video_path: str, output_dir: str, keep_temp: bool = False,
+                      task_id: str | None = None, task_logger: logging.Logger = None, task_manager=None,
+                      start_from: str = "extract_audio") -> Dict[str, str]:
+        """处理视频的完整流程
+
+        task_id/task_logger/task_manager 为本次任务的上下文，未传入时使用构造时的值，
+        因此同一个工作流实例可以被多个任务共享。
+        start_from 为起始阶段（见 STAGES），之前阶段的输出文件需已存在于 output_dir。
+        """
+        plan = _START_PLANS.get(start_from)
+        if plan is None:
+            raise ValueError(f"未知的起始阶段: {start_from}，可选: {', '.join(STAGES)}")
+        task_id = task_id or self.task_id
+        logger = task_logger or self.logger
+        task_manager = task_manager or self.task_manager
+        step_ctx = dict(task_manager=task_manager, task_id=task_id, logger=logger)
         os.makedirs(output_dir, exist_ok=True)
+        # 一次 scandir 取得已有文件，代替逐个 exists（网络存储上每次 stat 都是一次往返）
+        with os.scandir(output_dir) as it:
+            present = {entry.name for entry in it}
 
-        self.logger.info(f"开始处理视频: {video_path}")
-        self.logger.info(f"输出目录: {output_dir}")
+        logger.info(f"开始处理视频: {video_path}")
+        logger.info(f"输出目录: {output_dir}")
 
         # 定义文件路径
-        audio_path = os.path.join(output_dir, "audio.wav")
-        asr_json = os.path.join(output_dir, "asr_result.json")
-        merged_json = os.path.join(output_dir, "merged_text.json")
-        summary_json = os.path.join(output_dir, "summary.json")
+        audio_path = os.path.join(output_dir, _STAGE_OUTPUTS["extract_audio"])
+        asr_json = os.path.join(output_dir, _STAGE_OUTPUTS["asr"])
+        merged_json = os.path.join(output_dir, _STAGE_OUTPUTS["merge_text"])
+        summary_json = os.path.join(output_dir, _STAGE_OUTPUTS["summary"])
+        stages = plan.stages
+        notes_dir = os.path.join(output_dir, "multimodal_notes")
         multimodal_notes = None
+        summary = None
+        frames_future = None
 
         try:
-            # 1. 提取音频
-            run_step("extract_audio", extract_audio_for_asr, video_path, audio_path, task_manager=self.task_manager, task_id=self.task_id, logger=self.logger)
+            # 从中间阶段开始时，上一阶段的输出必须已存在
+            if plan.required:
+                if plan.required not in present:
+                    raise FileNotFoundError(f"无法从 {start_from} 开始，缺少上一阶段输出: {os.path.join(output_dir, plan.required)}")
+                logger.info(f"从阶段 {start_from} 开始，跳过: {', '.join(plan.skipped)}")
+
+            # 1. 提取音频；不保留临时文件时音频只在内存中交给 ASR，省去 audio.wav 的一次写入和读取
+            audio_data = None
+            if "extract_audio" in stages:
+                # ffmpeg 解码期间没有网络请求，后台预先与 ASR 服务建立连接，隐藏首个请求的握手延迟
+                threading.Thread(target=self.asr_service.warmup, name="asr-warmup", daemon=True).start()
+                settings = get_settings()
+                if keep_temp:
+                    run_step("extract_audio", extract_audio_for_asr, video_path, audio_path,
+                             settings.FFMPEG_PATH, settings.FFMPEG_THREADS, **step_ctx)
+                else:
+                    audio_data = run_step("extract_audio", read_audio_for_asr, video_path,
+                                          settings.FFMPEG_PATH, settings.FFMPEG_THREADS, settings.ASR_CHUNK_SECONDS > 0,
+                                          **step_ctx)
 
-            # 2. ASR转录
-            run_step("asr", self.asr_service.transcribe_audio, audio_path, asr_json, task_manager=self.task_manager, task_id=self.task_id, logger=self.logger)
+            # 2. ASR转录（2~4 阶段的输入内容与模型均未变化时复用已有输出）
+            if "asr" in stages:
+                self._run_stage("asr", self.asr_service.transcribe_audio,
+                                audio_data if audio_data is not None else audio_path, asr_json,
+                                self.asr_service.engine_type, step_ctx, digest=sha256_pcm,
+                                config={"chunk_seconds": self.asr_service.chunk_seconds,
+                                        "concurrency": self.asr_service.concurrency})
+                audio_data = None  # 尽早释放内存中的音频
 
             # 3. 文本合并
-            success = run_step("merge_text", self.text_merger.process_file, asr_json, merged_json, task_manager=self.task_manager, task_id=self.task_id, logger=self.logger)
-            if not success:
-                raise RuntimeError("文本合并失败")
+            merged = None
+            if "merge_text" in stages:
+                merged = self._run_stage("merge_text", self.text_merger.process_file, asr_json, merged_json,
+                                         self.model_id, step_ctx, config={"prompt": self.text_merger.prompt_sha256})
+                if not merged:
+                    raise RuntimeError("文本合并失败")
 
-            # 4. 生成摘要
-            success = run_step("summary", self.summary_generator.process_file, merged_json, summary_json, task_manager=self.task_manager, task_id=self.task_id, logger=self.logger)
-            if not success:
-                raise RuntimeError("摘要生成失败")
+            # 4. 生成摘要；图文笔记的抽帧去重只依赖合并文本的时间段，与摘要的 LLM 请求并行进行
+            if "summary" in stages:
+                if self.enable_multimodal and self.multimodal_generator:
+                    frames_future = get_prefetch_executor().submit(
+                        self.multimodal_generator.prefetch_segment_frames, video_path, merged_json, notes_dir, logger
+                    )
+                # 本次生成了合并结果时直接在内存中交给摘要，省去 merged_text.json 的再次解析
+                summary = self._run_stage("summary", self.summary_generator.process_file, merged_json, summary_json,
+                                          self.model_id, step_ctx, data=merged,
+                                          config={"prompt": self.summary_generator.prompt_sha256,
+                                                  "compress": self.summary_generator.compress})
+                if not summary:
+                    raise RuntimeError("摘要生成失败")
 
-            # 5. 生成图文笔记（可选）
+            # 5. 生成图文笔记（可选），本次生成了摘要时直接复用内存中的数据
             if self.enable_multimodal and self.multimodal_generator:
-                notes_dir = os.path.join(output_dir, "multimodal_notes")
-                multimodal_notes = run_step("multimodal", self.multimodal_generator.generate_multimodal_notes,
-                    video_path=video_path, summary_json_path=summary_json, output_dir=notes_dir,
-                    task_manager=self.task_manager, task_id=self.task_id, logger=self.logger
-                )
-            else:
-                multimodal_notes = None
-
-            # 清理临时文件
-            if not keep_temp:
-                try:
-                    os.unlink(audio_path)
-                    self.logger.info("清理临时音频文件")
-                except:
-                    pass
+                if summary is not None:
+                    prefetched = None
+                    if frames_future is not None:
+                        try:
+                            prefetched = frames_future.result()
+                        except Exception as e:
+                            logger.warning(f"预抽帧失败，改为逐段抽帧: {e}")
+                    multimodal_notes = run_step("multimodal", self.multimodal_generator.generate_multimodal_notes_from_obj,
+                        video_path, summary, notes_dir, logger, prefetched, **step_ctx
+                    )
+                else:
+                    multimodal_notes = run_step("multimodal", self.multimodal_generator.generate_multimodal_notes,
+                        video_path, summary_json, notes_dir, logger, **step_ctx
+                    )
+
+            # 清理临时文件：放到后台线程，大文件在慢速/网络存储上的删除不阻塞返回
+            # 不保留临时文件时本次不会写出 audio.wav，只需清理之前运行遗留的
+            if not keep_temp and _STAGE_OUTPUTS["extract_audio"] in present:
+                threading.Thread(target=_safe_unlink, args=(audio_path, logger), name="cleanup", daemon=True).start()
 
-            self.logger.info("✅ 处理完成！")
+            # 结果文件预压缩，下载时直接返回 .gz
+            precompress_files([asr_json, merged_json, summary_json, multimodal_notes])
+
+            logger.info("✅ 处理完成！")
             return {
                 "video_path": video_path,
                 "output_dir": output_dir,
@@ -113,7 +198,119 @@ class VideoProcessingWorkflow:
             }
 
         except Exception as e:
-            self.logger.error(f"❌ 处理失败: {e}")
-            if self.task_manager and self.task_id:
-                self.task_manager.update_status(self.task_id, "failed", str(e))
+            logger.error(f"❌ 处理失败: {e}")
+            # 预抽帧尚未开始时直接取消；已在运行时等它结束，避免任务标记失败后仍在写 notes_dir，与重试的预抽帧写同一目录
+            if frames_future is not None and not frames_future.cancel():
+                try:
+                    frames_future.result()
+                except Exception:
+                    pass
+            if task_manager and task_id:
+                task_manager.update_status(task_id, "failed", str(e))
             raise
+
+    def _run_stage(self, name: str, fn: Callable, source: str | bytes, output_path: str, model: str, step_ctx: dict,
+                   config: Optional[dict] = None, digest: Optional[Callable] = None, **kwargs):
+        """执行单输入单输出的阶段，并在输出旁写入 .meta.json 记录输入内容哈希、模型与影响输出的配置
+
+        source 为输入文件路径，或已在内存中的输入数据；config 为影响输出的配置项（提示词哈希、分片参数等）；
+        digest 为输入哈希函数，默认对整个输入内容计算 sha256；kwargs 原样传给 fn。
+
+        输出已存在且记录与当前输入一致时跳过执行，返回已有输出文件的内容。
+        """
+        logger = step_ctx["logger"]
+        meta_path = f"{output_path}.meta.json"
+        if digest is not None:
+            input_sha256 = digest(source)
+        else:
+            input_sha256 = hashlib.sha256(source).hexdigest() if isinstance(source, bytes) else sha256_file(source)
+        fingerprint = {"input_sha256": input_sha256, "model_id": model, "config": config or {},
+                       "tool_version": PIPELINE_VERSION}
+        # 不预先 exists：sidecar 或输出缺失时 open 抛出 FileNotFoundError，按未命中处理
+        try:
+            with open(meta_path, "rb") as f:
+                if orjson.loads(f.read()) == fingerprint:
+                    with open(output_path, "rb") as out:
+                        data = orjson.loads(out.read())
+                    logger.info(f"跳过步骤: {name}（输入未变化，复用 {os.path.basename(output_path)}）")
+                    if step_ctx["task_manager"] and step_ctx["task_id"]:
+                        step_ctx["task_manager"].update_step(step_ctx["task_id"], name)
+                    return data
+        except (OSError, orjson.JSONDecodeError):
+            pass
+
+        # 先删除旧记录，阶段中途失败时不会留下与半成品输出匹配的 sidecar
+        Path(meta_path).unlink(missing_ok=True)
+        result = run_step(name, fn, source, output_path, **step_ctx, **kwargs)
+        if result:
+            with atomic_write(meta_path, "wb") as f:
+                f.write(orjson.dumps(fingerprint))
+        return result
+
+
+@lru_cache(maxsize=1)
+def get_asr_service() -> ASRService:
+    """进程内共享的ASR服务（凭证与分片参数来自配置，不随模型变化）"""
+    s = get_settings()
+    try:
+        return ASRService(s.TENCENT_APPID, s.TENCENT_SECRET_ID, s.TENCENT_SECRET_KEY,
+                          chunk_seconds=s.ASR_CHUNK_SECONDS, concurrency=s.ASR_CONCURRENCY,
+                          ffmpeg_path=s.FFMPEG_PATH)
+    except ValueError as e:
+        raise RuntimeError(f"ASR服务初始化失败: {e}")
+
+
+def _safe_unlink(path: str, logger: logging.Logger):
+    """删除临时文件，失败只记录日志"""
+    try:
+        os.unlink(path)
+        logger.info("清理临时音频文件")
+    except OSError as e:
+        logger.warning(f"清理临时文件失败 {path}: {e}")
+
+
+# 进程级共享的工作流实例（按 模型ID + 是否启用图文笔记 区分），避免每个任务重复初始化各个服务
+_WORKFLOWS: Dict[Tuple[str, bool], VideoProcessingWorkflow] = {}
+_WORKFLOWS_LOCK = threading.Lock()
+
+
+def get_workflow(enable_multimodal: bool = True, model_id: str | None = None) -> VideoProcessingWorkflow:
+    """获取共享的工作流实例（首次调用时创建）；model_id 默认取配置中的 MODEL_ID"""
+    key = (model_id or get_settings().MODEL_ID, enable_multimodal)
+    workflow = _WORKFLOWS.get(key)
+    if workflow is None:
+        with _WORKFLOWS_LOCK:
+            workflow = _WORKFLOWS.get(key)
+            if workflow is None:
+                workflow = _WORKFLOWS[key] = VideoProcessingWorkflow(enable_multimodal=enable_multimodal, model_id=key[0])
+    return workflow
+
+
+@lru_cache(maxsize=1)
+def get_job_executor() -> ThreadPoolExecutor:
+    """后台任务专用线程池：与 FastAPI 事件循环及其默认线程池隔离，
+    视频处理主要耗时在 ffmpeg 子进程与网络请求上，线程即可并行"""
+    return ThreadPoolExecutor(max_workers=get_settings().MAX_CONCURRENT_TASKS, thread_name_prefix="video-job")
+
+
+@lru_cache(maxsize=1)
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    """预抽帧线程池：每个运行中的任务最多一个预抽帧作业，与摘要生成并行"""
+    return ThreadPoolExecutor(max_workers=get_settings().MAX_CONCURRENT_TASKS, thread_name_prefix="frame-prefetch")
+
+
+def submit_job(fn: Callable, task_id: str, *args) -> Future:
+    """提交后台任务到专用线程池，任务未捕获的异常在完成回调中记录
+
+    不使用进程池：ffmpeg 在子进程中运行，ASR/LLM 主要是网络等待，线程已能并行；
+    且任务日志器与 TaskManager 的内存元数据需要和 API 进程共享。
+    """
+    future = get_job_executor().submit(fn, task_id, *args)
+    future.add_done_callback(lambda f: _on_job_done(task_id, f))
+    return future
+
+
+def _on_job_done(task_id: str, future: Future):
+    exc = future.exception()
+    if exc is not None:
+        logging.getLogger(__name__).error(f"后台任务异常退出 - 任务ID: {task_id}: {exc}")
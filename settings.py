@@ -17,6 +17,9 @@ class Settings(BaseSettings):
     SERVER_PORT: int = Field(default=8001)
     API_BASE_URL: str | None = None  # override public URL, e.g. https://api.example.com
     FRONTEND_URL: str | None = None  # for CORS in production
+    UVICORN_WORKERS: int = 1  # >1 时启用多进程 worker（与热重载互斥）
+    RELOAD: bool | None = None  # 未设置时仅在 local 模式启用热重载
+    LOG_LEVEL: str = "INFO"  # DEBUG | INFO | WARNING | ERROR；低于该级别的日志不格式化也不输出
     # Core model & API providers
     MODEL_ID: str = Field(default="mistralai/ministral-8b")
     OPENAI_API_KEY: str | None = None
@@ -27,6 +30,15 @@ class Settings(BaseSettings):
     TENCENT_SECRET_KEY: str | None = None
     # System paths and tools
     FFMPEG_PATH: str = Field(default="ffmpeg")
+    LLM_CACHE_DIR: str = ""  # 文本合并/摘要的 LLM 结果缓存目录（默认留空关闭；缓存不会自动清理，开启时请指定专用目录）
+    USE_URING: bool = False  # Linux >= 5.6 且安装 liburing 时可启用 io_uring 写入后端
+    # Background processing
+    MAX_CONCURRENT_TASKS: int = 2  # 同时处理的视频任务数（专用线程池大小）
+    SUMMARY_MAX_CONCURRENCY: int = 4  # 单个任务内并发整理摘要的时间段数
+    COMPRESS_TRANSCRIPT: bool = False  # 摘要前去除口头语等填充词，减少 LLM 输入 token（会轻微改变原文）
+    ASR_CHUNK_SECONDS: int = 180  # 超过该时长的音频按静音点切片并发识别（0 为不切片）
+    ASR_CONCURRENCY: int = 3  # 单个任务内并发识别的 ASR 分片数
+    FFMPEG_THREADS: int = 2  # 单个任务音频转码的 ffmpeg 线程数（0 为 ffmpeg 默认），建议 任务数 × 线程数 ≈ CPU 核数
     # Upload policy
     MAX_UPLOAD_SIZE_MB: int = 500
     ALLOWED_EXTS: List[str] = Field(default_factory=lambda: ["mp4","avi","mov","mkv","webm"])
@@ -47,6 +59,10 @@ class Settings(BaseSettings):
     MULTIMODAL_EMBED_MODEL: str = "embed-v4.0"
     MULTIMODAL_BATCH_SIZE: int = 24
     MULTIMODAL_API_DELAY: float = 0.1
+    MULTIMODAL_EMBED_CONCURRENCY: int = 2  # 同时在途的图片 embedding 请求数（1 为完全串行）
+    MULTIMODAL_DEDUP_BACKEND: str = "phash"  # phash: 本地感知哈希去重 | embedding: Cohere 图片向量相似度去重
+    MULTIMODAL_PHASH_MAX_DISTANCE: int = 6  # phash 汉明距离不超过该值视为重复帧（0-64）
+    MULTIMODAL_HASH_WORKERS: int = 1  # phash 计算进程数（默认 1 在线程内计算；spawn 子进程会重新导入启动脚本，建议用 uvicorn main:app 启动时再开启）
 
     @property
     def public_api_base_url(self) -> str:
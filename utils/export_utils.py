@@ -3,6 +3,8 @@ import base64
 import re
 from pathlib import Path
 
+# Markdown 图片语法 ![alt](path)，模块加载时编译一次
+_IMG_PATTERN = re.compile(r'!\[([^\]]*)\]\(([^)]+)\)')
 
 def embed_images_in_content(content: str, task_dir: Path) -> str:
     """将markdown内容中的图片转换为base64嵌入"""
@@ -31,8 +33,7 @@ def embed_images_in_content(content: str, task_dir: Path) -> str:
         except Exception:
             return f'<p><em>图片加载失败: {image_path}</em></p>'
 
-    pattern = r'!\[([^\]]*)\]\(([^)]+)\)'
-    return re.sub(pattern, replace_image, content)
+    return _IMG_PATTERN.sub(replace_image, content)
 
 
 
@@ -1,7 +1,17 @@
 """文件操作工具函数"""
+import gzip
+import threading
 from pathlib import Path
-from typing import Optional
-from services.multimodal_note_generator import MultimodalNoteGenerator
+from typing import Iterable, Optional
+
+from fastapi import Request
+from fastapi.responses import FileResponse
+from services.multimodal_note_generator import MultimodalNoteGenerator, export_to_markdown
+from utils.io_utils import BIG_BUFFER, atomic_write
+
+# 导出接口共享的生成器实例（构造时会创建 Cohere 客户端并探测 ffmpeg）
+_mm_generator: Optional[MultimodalNoteGenerator] = None
+_mm_lock = threading.Lock()
 
 def find_notes_file(task_dir: Path) -> Optional[Path]:
     """查找图文笔记文件，统一处理重复逻辑"""
@@ -18,13 +28,22 @@ def find_notes_file(task_dir: Path) -> Optional[Path]:
     return None
 
 
+def is_up_to_date(target: Path, *sources: Path) -> bool:
+    """目标文件存在且不早于所有源文件（按 mtime 比较）"""
+    try:
+        target_mt = target.stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+    return all(target_mt >= src.stat().st_mtime_ns for src in sources if src.exists())
+
+
 def ensure_markdown_file(task_dir: Path, notes_file: Path) -> Path:
-    """确保markdown文件存在，如果不存在则生成"""
+    """确保markdown文件存在且不早于笔记JSON，否则重新生成"""
     markdown_file = task_dir / "notes.md"
 
-    if not markdown_file.exists():
-        generator = MultimodalNoteGenerator()
-        generator.export_to_markdown(
+    if not is_up_to_date(markdown_file, notes_file):
+        # 纯本地渲染，无需构造生成器（不会创建 Cohere 客户端）
+        export_to_markdown(
             notes_json_path=str(notes_file),
             output_path=str(markdown_file),
             image_base_path=str(task_dir),
@@ -34,6 +53,60 @@ def ensure_markdown_file(task_dir: Path, notes_file: Path) -> Path:
     return markdown_file
 
 
-def create_multimodal_generator():
-    """创建图文笔记生成器的统一方法"""
-    return MultimodalNoteGenerator()
+def create_multimodal_generator() -> MultimodalNoteGenerator:
+    """获取图文笔记生成器（进程内只创建一次）"""
+    global _mm_generator
+    if _mm_generator is None:
+        with _mm_lock:
+            if _mm_generator is None:
+                _mm_generator = MultimodalNoteGenerator()
+    return _mm_generator
+
+
+def precompress_files(paths: Iterable[str], compresslevel: int = 6):
+    """为结果文件生成同目录的 .gz 副本，下载时直接返回，避免每次请求重复压缩"""
+    for path in paths:
+        if not path:
+            continue
+        src = Path(path)
+        try:
+            data = src.read_bytes()
+        except FileNotFoundError:
+            continue
+        with atomic_write(src.with_name(src.name + ".gz"), "wb") as f:
+            f.write(gzip.compress(data, compresslevel=compresslevel))
+
+
+class LargeFileResponse(FileResponse):
+    """FileResponse 默认按 64 KiB 分块经线程池读取，改为 1 MiB 分块以减少线程池调度次数"""
+    chunk_size = BIG_BUFFER
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """按 Accept-Encoding 的编码与 q 值判断客户端是否接受 gzip（gzip;q=0 表示拒绝，未列出 gzip 时参考 *）"""
+    qvalues = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding] = q
+    q = qvalues.get("gzip", qvalues.get("x-gzip", qvalues.get("*", 0.0)))
+    return q > 0
+
+
+def precompressed_file_response(request: Request, path: Path, media_type: str, **kwargs) -> FileResponse:
+    """客户端接受 gzip 且存在不早于原文件的 .gz 副本时返回压缩版本，否则返回原文件"""
+    gz_path = path.with_name(path.name + ".gz")
+    if accepts_gzip(request.headers.get("accept-encoding", "")) and is_up_to_date(gz_path, path):
+        headers = {**kwargs.pop("headers", {}), "Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+        return LargeFileResponse(path=str(gz_path), media_type=media_type, headers=headers, **kwargs)
+    return LargeFileResponse(path=str(path), media_type=media_type, **kwargs)
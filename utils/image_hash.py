@@ -0,0 +1,126 @@
+"""
+帧感知哈希：pHash 计算与汉明距离
+
+哈希是纯 CPU 计算（JPEG 解码 + 缩放 + DCT），可在进程池中并行，
+本模块只依赖 numpy/PIL，便于子进程快速导入。
+"""
+from __future__ import annotations
+import io
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# 32x32 DCT-II 变换矩阵（pHash 只比较低频系数与中位数的大小关系，无需归一化）
+_DCT32 = np.cos(np.pi * np.outer(np.arange(32), 2 * np.arange(32) + 1) / 64).astype(np.float32)
+
+_M1, _M2, _M4, _H01 = (np.uint64(c) for c in (0x5555555555555555, 0x3333333333333333,
+                                               0x0f0f0f0f0f0f0f0f, 0x0101010101010101))
+
+
+def open_gray(data: bytes, size: int) -> Image.Image:
+    """把 JPEG 解码为 size x size 灰度图
+
+    draft 让 libjpeg 在解码阶段直接输出灰度并按 1/2~1/8 做 DCT 域缩小（只解码亮度通道、跳过高频系数），
+    360p 帧解码出的像素约为原来的 1/64，剩余少量缩放再交给 resize。
+    """
+    img = Image.open(io.BytesIO(data))
+    img.draft("L", (size, size))
+    return img.convert("L").resize((size, size))
+
+
+def phash_bytes(data: bytes) -> int:
+    """64 位感知哈希：32x32 灰度图做 DCT，取左上 8x8 低频系数与其中位数比较"""
+    img = open_gray(data, 32)
+    low = (_DCT32 @ np.asarray(img, dtype=np.float32) @ _DCT32.T)[:8, :8]
+    return int.from_bytes(np.packbits(low > np.median(low)).tobytes(), "big")
+
+
+def _safe_phash(data: bytes) -> Optional[int]:
+    try:
+        return phash_bytes(data)
+    except Exception:
+        return None
+
+
+def _popcount64(x: np.ndarray) -> np.ndarray:
+    """逐元素统计 uint64 中 1 的个数：numpy>=2.0 用硬件 popcount，否则用 SWAR 位运算"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    x = x - ((x >> np.uint64(1)) & _M1)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return (x * _H01) >> np.uint64(56)
+
+
+def hamming_matrix(hashes: List[int]) -> np.ndarray:
+    """64 位哈希两两之间的汉明距离矩阵（一次广播异或 + popcount）"""
+    h = np.array(hashes, dtype=np.uint64)
+    return _popcount64(h[:, None] ^ h[None, :]).astype(np.int32)
+
+
+# 进程内共享的哈希进程池；进程池损坏（子进程异常退出）后丢弃，下次调用时重建
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+# 每个子进程任务至少包含的帧数：单帧哈希约 1ms，逐帧往返一次 IPC 得不偿失
+_MIN_CHUNK = 16
+
+
+def get_hash_pool() -> Optional[ProcessPoolExecutor]:
+    """获取哈希进程池（MULTIMODAL_HASH_WORKERS 不超过 1 时不启用，返回 None）
+
+    使用 spawn 启动子进程：服务进程中已有多个线程，fork 可能复制到被其他线程持有的锁。
+    """
+    global _pool, _pool_workers
+    workers = get_settings().MULTIMODAL_HASH_WORKERS
+    if workers <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """丢弃已损坏的进程池（其他线程可能已经重建，只清除同一个对象）"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_hash_pool():
+    """关闭哈希进程池（应用关闭时调用）"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def hash_frames(frames: List[bytes]) -> List[Optional[int]]:
+    """批量计算 JPEG 帧的感知哈希，解码失败的帧为 None；启用进程池且帧数足够时在子进程中分块并行计算"""
+    pool = get_hash_pool() if len(frames) >= 2 * _MIN_CHUNK else None
+    if pool is None:
+        return [_safe_phash(data) for data in frames]
+    chunksize = max(_MIN_CHUNK, -(-len(frames) // (_pool_workers * 2)))
+    try:
+        return list(pool.map(_safe_phash, frames, chunksize=chunksize))
+    except BrokenProcessPool as e:
+        logger.warning(f"哈希进程池已损坏，重建前改为线程内计算: {e}")
+        _discard_pool(pool)
+    except Exception as e:
+        logger.warning(f"哈希进程池不可用，改为线程内计算: {e}")
+    return [_safe_phash(data) for data in frames]
@@ -0,0 +1,72 @@
+"""文件读写工具：大缓冲区读写、内容哈希"""
+from __future__ import annotations
+import os
+import mmap
+import uuid
+import hashlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Any, Iterator
+
+BIG_BUFFER = 1 << 20  # 1 MiB，默认缓冲区为 8 KiB
+
+
+def open_big(path: str | os.PathLike, mode: str = "r", **kwargs: Any) -> IO:
+    """与 open 相同，但使用 1 MiB 缓冲区；文本模式默认 UTF-8"""
+    if "b" not in mode:
+        kwargs.setdefault("encoding", "utf-8")
+    return open(path, mode, buffering=BIG_BUFFER, **kwargs)
+
+
+@contextmanager
+def atomic_write(path: str | os.PathLike, mode: str = "w", **kwargs: Any) -> Iterator[IO]:
+    """写入同目录下的临时文件，成功后 os.replace 原子替换目标；中途失败时删除临时文件，不留下半成品"""
+    path = os.fspath(path)
+    head, name = os.path.split(path)
+    tmp = os.path.join(head, f".{name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open_big(tmp, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def sha256_file(path: str | os.PathLike) -> str:
+    """计算文件内容的 sha256；通过 mmap 直接交给 hashlib，不复制到 Python 缓冲区"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                h.update(m)
+    return h.hexdigest()
+
+
+def _wav_data(buf: memoryview) -> memoryview:
+    """WAV 的 data 块内容（逐个跳过 RIFF 子块）；不是 WAV 或找不到 data 块时返回整个缓冲区"""
+    if len(buf) < 12 or buf[:4] != b"RIFF" or buf[8:12] != b"WAVE":
+        return buf
+    pos = 12
+    while pos + 8 <= len(buf):
+        size = int.from_bytes(buf[pos + 4:pos + 8], "little")
+        if buf[pos:pos + 4] == b"data":
+            # 管道输出的 WAV 可能未回填长度（0 或 0xFFFFFFFF），截断到实际长度
+            return buf[pos + 8:pos + 8 + size] if size else buf[pos + 8:]
+        pos += 8 + size + (size & 1)
+    return buf
+
+
+def sha256_pcm(source: str | os.PathLike | bytes) -> str:
+    """计算 WAV 音频 PCM 数据的 sha256，忽略头部：内存中封装的 WAV 与 ffmpeg 写出的 WAV 头部不同，PCM 相同则哈希相同"""
+    h = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        h.update(_wav_data(memoryview(source)))
+        return h.hexdigest()
+    with open(source, "rb") as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                # 关闭 mmap 前须释放其上的所有 memoryview
+                with memoryview(m) as view, _wav_data(view) as data:
+                    h.update(data)
+    return h.hexdigest()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+LLM 结果磁盘缓存：以 sha256(类型 + 模型ID + 提示词哈希 + 输入文本) 为键保存模型输出，
+重复处理相同的转录文本（重跑任务、从中间阶段开始）时直接复用，不再请求 API。
+"""
+from __future__ import annotations
+import os
+import uuid
+import hashlib
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Optional
+
+import orjson
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCache:
+    """按 <root>/<kind>/<key[:2]>/<key>.json 存放的文件缓存，读写失败时视为未命中"""
+
+    def __init__(self, root: str | os.PathLike):
+        self.root = Path(root).expanduser()
+
+    @staticmethod
+    def make_key(kind: str, model_id: str, prompt_sha256: str, payload: str) -> str:
+        h = hashlib.sha256()
+        for part in (kind, model_id, prompt_sha256, payload):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _path(self, kind: str, key: str) -> Path:
+        return self.root / kind / key[:2] / f"{key}.json"
+
+    def get(self, kind: str, model_id: str, prompt_sha256: str, payload: str) -> Any | None:
+        """命中返回缓存的值，未命中返回 None；prompt_sha256 为提示词模板的哈希，修改提示词后旧结果不再命中"""
+        path = self._path(kind, self.make_key(kind, model_id, prompt_sha256, payload))
+        try:
+            return orjson.loads(path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, orjson.JSONDecodeError) as e:
+            logger.warning(f"读取 LLM 缓存失败 {path}: {e}")
+            return None
+
+    def set(self, kind: str, model_id: str, prompt_sha256: str, payload: str, value: Any):
+        """写入缓存（先写临时文件再原子替换，并发写同一键互不干扰）"""
+        path = self._path(kind, self.make_key(kind, model_id, prompt_sha256, payload))
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_bytes(orjson.dumps(value))
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"写入 LLM 缓存失败 {path}: {e}")
+            tmp.unlink(missing_ok=True)
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache() -> Optional[LLMCache]:
+    """获取进程内共享的缓存实例（LLM_CACHE_DIR 为空时关闭缓存，返回 None）"""
+    root = get_settings().LLM_CACHE_DIR
+    return LLMCache(root) if root else None
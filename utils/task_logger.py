@@ -7,6 +7,8 @@ import logging
 from pathlib import Path
 from typing import Dict, Optional
 
+# LoggerMixin 未设置任务 logger 时的后备输出
+_fallback_logger = logging.getLogger(__name__)
 
 class TaskLogger:
     """任务日志管理器 - 为每个任务创建独立的logger"""
@@ -19,8 +21,9 @@ class TaskLogger:
         """
         获取或创建任务专用的logger
         """
-        if task_id in cls._loggers:
-            return cls._loggers[task_id]
+        logger = cls._loggers.get(task_id)
+        if logger is not None:
+            return logger
         
         # 创建logger
         logger = logging.getLogger(f"task_{task_id}")
@@ -114,28 +117,28 @@ class LoggerMixin:
         if self.logger:
             self.logger.info(message)
         else:
-            print(f"INFO: {message}")
+            _fallback_logger.info(message)
     
     def log_warning(self, message: str):
         """记录警告日志"""
         if self.logger:
             self.logger.warning(message)
         else:
-            print(f"WARNING: {message}")
+            _fallback_logger.warning(message)
     
     def log_error(self, message: str):
         """记录错误日志"""
         if self.logger:
             self.logger.error(message)
         else:
-            print(f"ERROR: {message}")
+            _fallback_logger.error(message)
     
     def log_debug(self, message: str):
         """记录调试日志"""
         if self.logger:
             self.logger.debug(message)
         else:
-            print(f"DEBUG: {message}")
+            _fallback_logger.debug(message)
 
 
 # 便捷函数
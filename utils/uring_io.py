@@ -0,0 +1,197 @@
+"""io_uring 批量 I/O 引擎（可选后端）
+
+仅在 USE_URING=1、已安装 liburing 且内核 >= 5.6 时启用；否则调用方回退到普通文件读写。
+单个守护线程持有一个 ring，从队列中批量取出读写请求一次性提交，再逐个收割完成事件。
+"""
+from __future__ import annotations
+import os
+import queue
+import logging
+import platform
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Union
+
+from settings import get_settings
+
+try:
+    import liburing
+except ImportError:  # 可选依赖
+    liburing = None
+
+logger = logging.getLogger(__name__)
+
+MIN_KERNEL = (5, 6)
+
+
+@dataclass
+class UringOp:
+    """单个读写请求"""
+    op: str  # "write" | "read"
+    fd: int
+    buf: Union[bytes, bytearray, memoryview]
+    offset: int
+    future: Future = field(default_factory=Future)
+
+
+class IoUringBatchEngine:
+    """守护线程 + 单 ring 的批量提交引擎"""
+
+    def __init__(self, entries: int = 64, max_batch: int = 32):
+        if liburing is None:
+            raise RuntimeError("liburing 未安装")
+        self.max_batch = min(max_batch, entries)
+        self._queue: "queue.Queue[UringOp]" = queue.Queue()
+        self._ring = liburing.io_uring()
+        self._cqes = liburing.io_uring_cqes()
+        liburing.io_uring_queue_init(entries, self._ring, 0)
+        self._thread = threading.Thread(target=self._run, name="io-uring", daemon=True)
+        self._thread.start()
+
+    def submit_write(self, fd: int, data: Union[bytes, bytearray, memoryview], offset: int) -> Future:
+        """提交写请求，Future 结果为写入字节数"""
+        op = UringOp("write", fd, data, offset)
+        self._queue.put(op)
+        return op.future
+
+    def submit_read(self, fd: int, size: int, offset: int) -> Future:
+        """提交读请求，Future 结果为读到的 bytes"""
+        op = UringOp("read", fd, bytearray(size), offset)
+        self._queue.put(op)
+        return op.future
+
+    def _run(self):
+        while True:
+            ops: List[UringOp] = [self._queue.get()]
+            while len(ops) < self.max_batch:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._submit_batch(ops)
+            except Exception as e:  # ring 异常时让所有等待方感知，而不是永久阻塞
+                for op in ops:
+                    if not op.future.done():
+                        op.future.set_exception(e)
+
+    def _submit_batch(self, ops: List[UringOp]):
+        for i, op in enumerate(ops):
+            sqe = liburing.io_uring_get_sqe(self._ring)
+            if op.op == "write":
+                liburing.io_uring_prep_write(sqe, op.fd, op.buf, len(op.buf), op.offset)
+            else:
+                liburing.io_uring_prep_read(sqe, op.fd, op.buf, len(op.buf), op.offset)
+            sqe.user_data = i
+        liburing.io_uring_submit(self._ring)
+
+        for _ in ops:
+            liburing.io_uring_wait_cqe(self._ring, self._cqes)
+            cqe = self._cqes[0]
+            op, res = ops[cqe.user_data], cqe.res
+            liburing.io_uring_cqe_seen(self._ring, cqe)
+            if res < 0:
+                op.future.set_exception(OSError(-res, os.strerror(-res)))
+            elif op.op == "write":
+                op.future.set_result(res)
+            else:
+                op.future.set_result(bytes(op.buf[:res]))
+
+
+def _kernel_version() -> tuple:
+    try:
+        return tuple(int(x) for x in platform.release().split("-")[0].split(".")[:2])
+    except ValueError:
+        return (0, 0)
+
+
+@lru_cache(maxsize=1)
+def uring_enabled() -> bool:
+    """是否启用 io_uring 后端"""
+    if not get_settings().USE_URING:
+        return False
+    if liburing is None:
+        logger.warning("USE_URING=1 但未安装 liburing，回退到普通文件 I/O")
+        return False
+    if platform.system() != "Linux" or _kernel_version() < MIN_KERNEL:
+        logger.warning(f"内核版本 {platform.release()} 不支持 io_uring，回退到普通文件 I/O")
+        return False
+    return True
+
+
+@lru_cache(maxsize=1)
+def get_engine() -> Optional[IoUringBatchEngine]:
+    """获取进程内共享的引擎实例（未启用时返回 None）"""
+    if not uring_enabled():
+        return None
+    return IoUringBatchEngine()
+
+
+def write_all(engine: IoUringBatchEngine, fd: int, data: Union[bytes, memoryview], offset: int) -> int:
+    """写入整块数据，处理短写"""
+    view = memoryview(data)
+    written = 0
+    while written < len(view):
+        n = engine.submit_write(fd, view[written:], offset + written).result()
+        if n == 0:
+            raise OSError("io_uring 写入返回 0 字节")
+        written += n
+    return written
+
+
+def copy_stream(engine: IoUringBatchEngine, src, dst_path: Union[str, os.PathLike],
+                chunk_size: int = 1 << 20, max_inflight: int = 8) -> int:
+    """将可读流按块写入目标文件，最多 max_inflight 个写请求同时在途"""
+    fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        offset, inflight = 0, []
+        while chunk := src.read(chunk_size):
+            inflight.append((engine.submit_write(fd, chunk, offset), chunk, offset))
+            offset += len(chunk)
+            if len(inflight) >= max_inflight:
+                _finish_writes(engine, fd, inflight)
+                inflight = []
+        _finish_writes(engine, fd, inflight)
+        return offset
+    finally:
+        os.close(fd)
+
+
+def _finish_writes(engine: IoUringBatchEngine, fd: int, inflight: list):
+    for fut, chunk, offset in inflight:
+        n = fut.result()
+        if n < len(chunk):
+            write_all(engine, fd, memoryview(chunk)[n:], offset + n)
+
+
+def write_files(engine: IoUringBatchEngine, files: Dict[str, bytes]):
+    """批量写入多个小文件：一次提交，统一等待"""
+    fds, inflight = {}, []
+    try:
+        for path, data in files.items():
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            fds[path] = fd
+            inflight.append((fd, engine.submit_write(fd, data, 0), data))
+        for fd, fut, data in inflight:
+            n = fut.result()
+            if n < len(data):
+                write_all(engine, fd, memoryview(data)[n:], n)
+    finally:
+        for fd in fds.values():
+            os.close(fd)
+
+
+def read_files(engine: IoUringBatchEngine, paths: Iterable[str]) -> Dict[str, bytes]:
+    """批量读取多个小文件"""
+    fds, inflight = {}, []
+    try:
+        for path in paths:
+            fd = os.open(path, os.O_RDONLY)
+            fds[path] = fd
+            inflight.append((path, engine.submit_read(fd, os.fstat(fd).st_size, 0)))
+        return {path: fut.result() for path, fut in inflight}
+    finally:
+        for fd in fds.values():
+            os.close(fd)